@@ -4,7 +4,7 @@ import numpy as np
 from scipy import stats
 import csv
 import pathlib
-from math import floor, log10, fsum
+from math import floor, log10, fsum, isfinite
 from functools import lru_cache
 import json
 import matplotlib.pyplot as plt
@@ -12,6 +12,11 @@ from matplotlib import ticker
 import seaborn as sns
 import argparse
 
+try:
+    import orjson
+except ImportError:  # optional dependency, the standard json module is used when it's not available
+    orjson = None
+
 from logic.stakeholder_profiles import PROFILE_MAPPING
 from logic.reward_schemes import RSS_MAPPING
 from logic.model_reporters import REPORTER_IDS
@@ -154,37 +159,61 @@ def generate_cost_distr_nrm(num_agents, low, high, mean, stddev):
     return costs
 
 
-# @lru_cache(maxsize=1024)
 def calculate_potential_profit(reward_scheme, pledge, cost):
     """
     Calculate a pool's potential profit, which can be defined as the profit it would get at saturation level
+    Note that the results are cached by the reward scheme (until its parameters change)
     :param reward_scheme: the reward scheme object (of an RSS subclass) used in the simulation
     :param pledge: the pledge of the pool in question
     :param cost: the cost of the pool in question
     :return: float, the maximum possible profit that this pool can yield, aka its profit at saturation
     """
-    potential_reward = calculate_pool_reward(
-        reward_scheme=reward_scheme, pool_stake=reward_scheme.get_pool_saturation_threshold(pledge), pool_pledge=pledge
+    return reward_scheme.cached_potential_profit(pledge, cost)
+
+
+def calculate_potential_profits(reward_scheme, pledges, costs):
+    """
+    Calculate the potential profits of multiple pools at once (vectorised version of calculate_potential_profit)
+    :param reward_scheme: the reward scheme object (of an RSS subclass) used in the simulation
+    :param pledges: numpy array with the pledges of the pools in question
+    :param costs: numpy array with the costs of the pools in question
+    :return: numpy array with the potential profits of the pools
+    """
+    potential_rewards = reward_scheme.calculate_pool_rewards(
+        pool_pledges=pledges, pool_stakes=reward_scheme.get_pool_saturation_thresholds(pledges)
     )
-    return potential_reward - cost
+    return potential_rewards - costs
 
 
 # @lru_cache(maxsize=1024)
 def calculate_current_profit(stake, pledge, cost, reward_scheme):
-    reward = calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=stake, pool_pledge=pledge)
+    reward = reward_scheme.calculate_pool_reward(pool_pledge=pledge, pool_stake=stake)
     return reward - cost
 
 
 def calculate_pool_reward(reward_scheme, pool_stake, pool_pledge):
-    return reward_scheme.calculate_pool_reward(pool_pledge=pool_pledge, pool_stake=pool_stake)
+    # note that the results are cached by the reward scheme (until its parameters change). Functions of this module
+    # whose arguments rarely repeat call the reward scheme's method directly instead, to avoid filling up the cache
+    return reward_scheme.cached_pool_reward(pool_pledge, pool_stake)
+
+
+def calculate_pool_rewards(reward_scheme, pool_stakes, pool_pledges):
+    """
+    Calculate the rewards of multiple pools at once (vectorised version of calculate_pool_reward)
+    :param reward_scheme: the reward scheme object (of an RSS subclass) used in the simulation
+    :param pool_stakes: numpy array with the stakes of the pools in question
+    :param pool_pledges: numpy array with the pledges of the pools in question
+    :return: numpy array with the rewards of the pools
+    """
+    return reward_scheme.calculate_pool_rewards(pool_pledges=pool_pledges, pool_stakes=pool_stakes)
 
 
 @lru_cache(maxsize=1024)
 def calculate_delegator_reward_from_pool(pool_margin, pool_cost, pool_reward, delegator_stake_fraction):
     margin_factor = (1 - pool_margin) * delegator_stake_fraction
     pool_profit = pool_reward - pool_cost
-    r_d = max(margin_factor * pool_profit, 0)
-    return r_d
+    r_d = margin_factor * pool_profit
+    return 0 if r_d < 0 else r_d
 
 
 @lru_cache(maxsize=1024)
@@ -194,20 +223,18 @@ def calculate_operator_reward_from_pool(pool_margin, pool_cost, pool_reward, ope
     return pool_profit if pool_profit <= 0 else pool_profit * margin_factor
 
 
-def calculate_non_myopic_pool_stake(pool, pool_rankings, reward_scheme, total_stake):
+def calculate_non_myopic_pool_stake(pool, pool_rankings, reward_scheme, total_stake, rank_in_top_pools=None):
     """
     Calculate the non-myopic stake of a pool, given the pool and the state of the system (other active pools)
     :param pool:
     :param pool_rankings:
     :param reward_scheme: the reward scheme object used in the simulation
     :total_stake: the total stake of the system
+    :rank_in_top_pools: whether the pool ranks in the top pools, if already known (see is_pool_in_top_pools)
     :return: the value of the non-myopic stake of the pool with id pool_id
     """
-    rank = pool_rankings.index(pool)
-    better_pools_stake_at_saturation = fsum(
-        [reward_scheme.get_pool_saturation_threshold(p.pledge) for p in pool_rankings[:rank]])
-    # check whether the higher-ranked pools suffice to cover the system's total stake without getting over-saturated
-    rank_in_top_pools = better_pools_stake_at_saturation + MIN_STAKE_UNIT < total_stake
+    if rank_in_top_pools is None:
+        rank_in_top_pools = is_pool_in_top_pools(pool, pool_rankings, reward_scheme, total_stake)
     return calculate_non_myopic_pool_stake_from_rank(
         pool_pledge=pool.pledge,
         pool_stake=pool.stake,
@@ -216,6 +243,33 @@ def calculate_non_myopic_pool_stake(pool, pool_rankings, reward_scheme, total_st
     )
 
 
+def is_pool_in_top_pools(pool, pool_rankings, reward_scheme, total_stake):
+    """
+    Check whether a pool ranks high enough to attract stake in the long term, i.e. whether the pools that rank higher
+    than it don't suffice to cover the system's total stake without getting over-saturated
+    :param pool:
+    :param pool_rankings:
+    :param reward_scheme: the reward scheme object used in the simulation
+    :total_stake: the total stake of the system
+    :return: True if the pool ranks in the top pools, False otherwise
+    """
+    rank = pool_rankings.index(pool)
+    return is_pool_in_top_pools_given_better_pools(pool_rankings[:rank], reward_scheme, total_stake)
+
+
+def is_pool_in_top_pools_given_better_pools(better_pools, reward_scheme, total_stake):
+    """
+    Check whether a pool ranks in the top pools, given the pools that rank higher than it (in any order)
+    :param better_pools: the pools that rank higher than the pool in question
+    :param reward_scheme: the reward scheme object used in the simulation
+    :total_stake: the total stake of the system
+    :return: True if the pool ranks in the top pools, False otherwise
+    """
+    better_pools_stake_at_saturation = fsum(
+        [reward_scheme.get_pool_saturation_threshold(p.pledge) for p in better_pools])
+    return better_pools_stake_at_saturation + MIN_STAKE_UNIT < total_stake
+
+
 def calculate_ranks(ranking_dict, *tie_breaking_dicts, rank_ids=True):
     """
     Rank the values of a dictionary from highest to lowest (highest value gets rank 1, second highest rank 2 and so on)
@@ -229,15 +283,14 @@ def calculate_ranks(ranking_dict, *tie_breaking_dicts, rank_ids=True):
     if rank_ids:
         tie_breaking_dicts = list(tie_breaking_dicts)
         tie_breaking_dicts.append({key: -key for key in ranking_dict.keys()})
-    final_ranking_dict = {
-        key:
-            (ranking_dict[key],) + tuple(tie_breaker_dict[key] for tie_breaker_dict in tie_breaking_dicts)
-        for key in ranking_dict
-    }
-    ranks = {
-        sorted_item[0]: i + 1 for i, sorted_item in
-        enumerate(sorted(final_ranking_dict.items(), key=lambda item: item[1], reverse=True))
-    }
+    keys = list(ranking_dict.keys())
+    # np.lexsort uses the last array as the primary sort key and sorts in ascending order (stably),
+    # so the arrays are given in reverse order of priority and negated to rank from highest to lowest
+    sort_keys = [-np.array([tie_breaker_dict[key] for key in keys], dtype=float)
+                 for tie_breaker_dict in reversed(tie_breaking_dicts)]
+    sort_keys.append(-np.array([ranking_dict[key] for key in keys], dtype=float))
+    order = np.lexsort(sort_keys).tolist() if len(keys) > 0 else []
+    ranks = {keys[i]: rank for rank, i in enumerate(order, start=1)}
     return ranks
 
 
@@ -266,22 +319,24 @@ def calculate_cost_per_pool(num_pools, initial_cost, extra_pool_cost_fraction):
 @lru_cache(maxsize=1024)
 def calculate_suitable_margin(potential_profit, target_desirability):
     m = 1 - target_desirability / potential_profit if potential_profit > 0 else 0
-    return max(m, 0)
+    return 0 if m < 0 else m
 
 
 @lru_cache(maxsize=1024)
 def calculate_pool_desirability(margin, potential_profit):
-    return max((1 - margin) * potential_profit, 0)
+    desirability = (1 - margin) * potential_profit
+    return 0 if desirability < 0 else desirability
 
 
 @lru_cache(maxsize=1024)
 def calculate_myopic_pool_desirability(margin, current_profit):
-    return max((1 - margin) * current_profit, 0)
+    desirability = (1 - margin) * current_profit
+    return 0 if desirability < 0 else desirability
 
 
 # @lru_cache(maxsize=1024)
 def calculate_operator_utility_from_pool(pool_stake, pledge, margin, cost, reward_scheme):
-    r = calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=pool_stake, pool_pledge=pledge)
+    r = reward_scheme.calculate_pool_reward(pool_pledge=pledge, pool_stake=pool_stake)
     stake_fraction = pledge / pool_stake
     return calculate_operator_reward_from_pool(pool_margin=margin, pool_cost=cost, pool_reward=r,
                                                operator_stake_fraction=stake_fraction)
@@ -289,7 +344,7 @@ def calculate_operator_utility_from_pool(pool_stake, pledge, margin, cost, rewar
 
 # @lru_cache(maxsize=1024)
 def calculate_delegator_utility_from_pool(stake_allocation, pool_stake, pledge, margin, cost, reward_scheme):
-    r = calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=pool_stake, pool_pledge=pledge)
+    r = reward_scheme.calculate_pool_reward(pool_pledge=pledge, pool_stake=pool_stake)
     stake_fraction = stake_allocation / pool_stake
     return calculate_delegator_reward_from_pool(pool_margin=margin, pool_cost=cost, pool_reward=r,
                                                 delegator_stake_fraction=stake_fraction)
@@ -297,7 +352,9 @@ def calculate_delegator_utility_from_pool(stake_allocation, pool_stake, pledge,
 
 @lru_cache(maxsize=1024)
 def calculate_non_myopic_pool_stake_from_rank(pool_pledge, pool_stake, pool_saturation_threshold, rank_in_top_pools):
-    return max(pool_saturation_threshold, pool_stake) if rank_in_top_pools else pool_pledge
+    if not rank_in_top_pools:
+        return pool_pledge
+    return pool_stake if pool_stake > pool_saturation_threshold else pool_saturation_threshold
 
 
 @lru_cache(maxsize=1024)
@@ -321,8 +378,31 @@ def export_csv_file(rows, filepath):
 
 
 def export_json_file(data, filepath):
+    # both ways of writing the file give the same output: an indentation of 2 spaces (the only one orjson supports),
+    # numpy values as lists or numbers and non-finite floats (not part of the JSON standard) as null
+    if orjson is not None:
+        options = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(data, default=str, option=options))
+        return
     with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4, default=lambda x: str(x))
+        json.dump(_replace_non_finite_floats(data), f, ensure_ascii=False, indent=2, default=_to_serialisable)
+
+
+def _to_serialisable(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return _replace_non_finite_floats(value.tolist())
+    return str(value)
+
+
+def _replace_non_finite_floats(data):
+    if isinstance(data, float):
+        return data if isfinite(data) else None
+    if isinstance(data, dict):
+        return {key: _replace_non_finite_floats(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_replace_non_finite_floats(value) for value in data]
+    return data
 
 
 def read_args_from_file(filepath):
@@ -592,6 +672,12 @@ def add_script_arguments(parser):
     parser.add_argument('--generate_graphs', type=bool, default=True, action=argparse.BooleanOptionalAction,
                         help='If True then graphs relating to the tracked metrics are generated upon completion. Default'
                              'is True.'),
+    parser.add_argument('--save_pickle', type=bool, default=False, action=argparse.BooleanOptionalAction,
+                        help='If True then the simulation object is saved in a (compressed) pickle file upon '
+                             'completion. Default is False.')
+    parser.add_argument('--verbose', type=bool, default=False, action=argparse.BooleanOptionalAction,
+                        help='If True then the status of the simulation is printed at every step, otherwise only every '
+                             '50 steps. Default is False.')
     parser.add_argument('--seed', nargs="?", type=non_negative_int, default=None,
                         help='Seed for reproducibility. Default is None, which means that a seed is chosen at random.')
     parser.add_argument('--execution_id', nargs="?", type=str, default='',
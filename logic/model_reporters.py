@@ -7,34 +7,40 @@ from math import fsum
 import logic.helper as hlp
 
 
+def get_pool_values(pools, attribute):
+    """
+    Gather the values of an attribute (e.g. stake or pledge) of the given pools in a list. The aggregate metrics are
+    calculated on plain lists (with fsum and the statistics module), as numpy's reductions round differently
+    """
+    return [getattr(pool, attribute) for pool in pools]
+
+
 def get_number_of_pools(model):
     return len(model.pools)
 
 
 def get_avg_margin(model):
-    pools = model.get_pools_list()
-    margins = [pool.margin for pool in pools]
+    margins = get_pool_values(model.get_pools_list(), 'margin')
     return statistics.mean(margins) if len(margins) > 0 else 0
 
 
 def get_median_margin(model):
-    pools = model.get_pools_list()
-    margins = [pool.margin for pool in pools]
+    margins = get_pool_values(model.get_pools_list(), 'margin')
     return statistics.median(margins) if len(margins) > 0 else 0
 
 
 def get_avg_pledge(model):
-    current_pool_pledges = [pool.pledge for pool in model.get_pools_list()]
+    current_pool_pledges = get_pool_values(model.get_pools_list(), 'pledge')
     return statistics.mean(current_pool_pledges) if len(current_pool_pledges) > 0 else 0
 
 
 def get_total_pledge(model):
-    current_pool_pledges = [pool.pledge for pool in model.get_pools_list()]
+    current_pool_pledges = get_pool_values(model.get_pools_list(), 'pledge')
     return fsum(current_pool_pledges)
 
 
 def get_median_pledge(model):
-    current_pool_pledges = [pool.pledge for pool in model.get_pools_list()]
+    current_pool_pledges = get_pool_values(model.get_pools_list(), 'pledge')
     return statistics.median(current_pool_pledges) if len(current_pool_pledges) > 0 else 0
 
 
@@ -153,10 +159,12 @@ def get_nakamoto_coefficient(model):
     final_stake = [controlled_stake[agent_id] for agent_id in active_agents.keys()]
     total_active_stake = fsum(final_stake)
     sorted_final_stake = sorted(final_stake, reverse=True)
-    cumulative_final_stake = np.array([fsum(sorted_final_stake[:i + 1]) for i in range(len(sorted_final_stake))])
     majority_threshold = total_active_stake / 2
-    nc = np.argmax(cumulative_final_stake > majority_threshold) + 1
-    return nc
+    # the (accurate) cumulative stake is only calculated until the majority threshold is surpassed
+    for nc in range(1, len(sorted_final_stake) + 1):
+        if fsum(sorted_final_stake[:nc]) > majority_threshold:
+            return nc
+    return 1
 
 
 # note that this reporter cannot be used with multiprocessing (i.e. with the way batch-run currently works)
@@ -205,8 +213,8 @@ def get_pledge_rate(model):
     pools = model.get_pools_list()
     if len(pools) == 0:
         return 0
-    total_active_stake = fsum([pool.stake for pool in pools])
-    total_pledge = fsum([pool.pledge for pool in pools])
+    total_active_stake = fsum(get_pool_values(pools, 'stake'))
+    total_pledge = fsum(get_pool_values(pools, 'pledge'))
     return total_pledge / total_active_stake
 
 
@@ -220,7 +228,7 @@ def get_homogeneity_factor(model):
     pool_count = len(pools)
     if pool_count == 0:
         return 0
-    pool_stakes = [pool.stake for pool in pools]
+    pool_stakes = get_pool_values(pools, 'stake')
     max_stake = max(pool_stakes)
 
     ideal_area = pool_count * max_stake
@@ -235,34 +243,28 @@ def get_iterations(model):
 
 def get_avg_stk_rnk(model):
     pools = model.get_pools_list()
-    all_agents = model.get_agents_dict()
-    stakes = {agent_id: agent.stake for agent_id, agent in all_agents.items()}
-    stake_ranks = hlp.calculate_ranks(stakes)
+    stake_ranks = model.get_agent_ranks('stake')
     pool_owner_stk_ranks = [stake_ranks[pool.owner] for pool in pools]
     return round(statistics.mean(pool_owner_stk_ranks)) if len(pool_owner_stk_ranks) > 0 else 0
 
 
 def get_avg_cost_rnk(model):
     pools = model.get_pools_list()
-    all_agents = model.get_agents_dict()
-    negative_cost_ranks = hlp.calculate_ranks({agent_id: -agent.cost for agent_id, agent in all_agents.items()})
+    negative_cost_ranks = model.get_agent_ranks('cost', descending=False)
     pool_owner_cost_ranks = [negative_cost_ranks[pool.owner] for pool in pools]
     return round(statistics.mean(pool_owner_cost_ranks)) if len(pool_owner_cost_ranks) > 0 else 0
 
 
 def get_median_stk_rnk(model):
     pools = model.get_pools_list()
-    all_agents = model.get_agents_dict()
-    stakes = {agent_id: agent.stake for agent_id, agent in all_agents.items()}
-    stake_ranks = hlp.calculate_ranks(stakes)
+    stake_ranks = model.get_agent_ranks('stake')
     pool_owner_stk_ranks = [stake_ranks[pool.owner] for pool in pools]
     return round(statistics.median(pool_owner_stk_ranks)) if len(pool_owner_stk_ranks) > 0 else 0
 
 
 def get_median_cost_rnk(model):
     pools = model.get_pools_list()
-    all_agents = model.get_agents_dict()
-    negative_cost_ranks = hlp.calculate_ranks({agent_id: -agent.cost for agent_id, agent in all_agents.items()})
+    negative_cost_ranks = model.get_agent_ranks('cost', descending=False)
     pool_owner_cost_ranks = [negative_cost_ranks[pool.owner] for pool in pools]
     return round(statistics.median(pool_owner_cost_ranks)) if len(pool_owner_cost_ranks) > 0 else 0
 
@@ -279,13 +281,10 @@ def get_pool_splitter_count(model):
 
 
 def get_cost_efficient_count(model):
-    all_agents = model.get_agents_list()
-    potential_profits = [
-        hlp.calculate_potential_profit(reward_scheme=model.reward_scheme, pledge=agent.stake, cost=agent.cost)
-        for agent in all_agents
-    ]
-    positive_potential_profits = [pp for pp in potential_profits if pp > 0]
-    return len(positive_potential_profits)
+    potential_profits = hlp.calculate_potential_profits(
+        reward_scheme=model.reward_scheme, pledges=model.agent_stakes, costs=model.agent_costs
+    )
+    return int(np.count_nonzero(potential_profits > 0))
 
 
 def get_pool_stakes_by_agent(model):
@@ -363,17 +362,16 @@ def get_gini_id_coeff_stake_k_agents(model):
 
 def get_total_delegated_stake(model):
     pools = model.get_pools_list()
-    del_stake = fsum([pool.stake for pool in pools])
-    total_stake = fsum([agent.stake for agent in model.schedule.agents])
+    del_stake = fsum(get_pool_values(pools, 'stake'))
     return del_stake
 
 
 def get_active_stake_agents(model):
-    return fsum([agent.stake for agent in model.schedule.agents])
+    return fsum(model.agent_stakes)
 
 
 def get_stake_distr_stats(model):
-    stake_distribution = np.array([agent.stake for agent in model.schedule.agents])
+    stake_distribution = model.agent_stakes
     return stake_distribution.max(), stake_distribution.min(), stake_distribution.mean(), np.median(
         stake_distribution), stake_distribution.std()
 
@@ -417,6 +415,9 @@ ALL_MODEL_REPORTEERS = {
     "Operator count": get_operator_count
 }
 
+# reporters whose values can change from one step to the next even when the state of the system stays the same
+STEP_DEPENDENT_REPORTERS = {"Iterations"}
+
 REPORTER_IDS = {
     1: "Pool count",
     2: "Total pledge",
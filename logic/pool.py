@@ -3,6 +3,9 @@ import logic.helper as hlp
 
 
 class Pool:
+    __slots__ = ['id', 'cost', 'pledge', 'stake', 'owner', 'is_private', 'delegators', 'potential_profit', '_margin',
+                 'desirability', '_myopic_desirability', '_myopic_desirability_inputs', '_delegators_shared']
+
     def __init__(self, pool_id, cost, pledge, owner, reward_scheme, margin=-1, is_private=False):
         self.id = pool_id
         self.cost = cost
@@ -11,6 +14,7 @@ class Pool:
         self.owner = owner
         self.is_private = is_private
         self.delegators = dict()
+        self._delegators_shared = False
         self.set_profit(reward_scheme)
         self.margin = margin
 
@@ -27,11 +31,46 @@ class Pool:
     def set_profit(self, reward_scheme):
         self.potential_profit = hlp.calculate_potential_profit(reward_scheme=reward_scheme, pledge=self.pledge,
                                                                cost=self.cost)
+        # the profit of the pool may have changed (e.g. because the reward scheme changed), so the cached myopic
+        # desirability can't be trusted anymore
+        self._myopic_desirability = None
+        self._myopic_desirability_inputs = None
 
     def set_desirability(self):
         self.desirability = hlp.calculate_pool_desirability(margin=self.margin, potential_profit=self.potential_profit)
 
+    def get_myopic_desirability(self, reward_scheme):
+        """
+        Calculate the desirability of the pool based on its current (instead of its potential) profit. The result is
+        cached until the stake, pledge, cost or margin of the pool change, or until set_profit is called
+        @param reward_scheme: the reward scheme object (of an RSS subclass) used in the simulation
+        @return: the myopic desirability of the pool
+        """
+        inputs = (self.stake, self.pledge, self.cost, self._margin)
+        if inputs != self._myopic_desirability_inputs:
+            current_profit = hlp.calculate_current_profit(self.stake, self.pledge, self.cost, reward_scheme)
+            self._myopic_desirability = hlp.calculate_myopic_pool_desirability(self._margin, current_profit)
+            self._myopic_desirability_inputs = inputs
+        return self._myopic_desirability
+
+    def copy(self):
+        """
+        Create a copy of the pool that can be modified without affecting the original one. All the attributes of a pool
+        are immutable apart from its delegators, so this is equivalent to (but much faster than) a deep copy.
+        The delegators are shared between the two pools until one of them updates a delegation (copy-on-write),
+        as most copies are hypothetical pools that are discarded without their delegations ever changing
+        @return: the new Pool object
+        """
+        pool_copy = self.__class__.__new__(self.__class__)
+        for attribute in Pool.__slots__:
+            setattr(pool_copy, attribute, getattr(self, attribute))
+        self._delegators_shared = pool_copy._delegators_shared = True
+        return pool_copy
+
     def update_delegation(self, new_delegation, delegator_id):
+        if self._delegators_shared:
+            self.delegators = dict(self.delegators)
+            self._delegators_shared = False
         if delegator_id in self.delegators:
             self.stake -= self.delegators[delegator_id]
         self.stake += new_delegation
@@ -1,3 +1,7 @@
+from functools import lru_cache
+
+import numpy as np
+
 TOTAL_EPOCH_REWARDS_R = 1
 
 
@@ -13,6 +17,29 @@ class RSS:
         self.k = k
         self.a0 = a0 
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith('cached_'):
+            # the cached results depend on the parameters of the reward scheme (k, a0, etc.), so they are discarded
+            # whenever one of them changes
+            self.reset_caches()
+
+    def __getstate__(self):
+        # the caches can't be pickled, so they are left out and recreated when the object is unpickled
+        return {name: value for name, value in vars(self).items() if not name.startswith('cached_')}
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self.reset_caches()
+
+    def reset_caches(self):
+        """
+        Discard the cached results of the methods that depend on the parameters of the reward scheme. The caches
+        belong to the reward scheme object, so they are discarded together with it
+        """
+        self.cached_potential_profit = lru_cache(maxsize=1024)(self.calculate_potential_profit)
+        self.cached_pool_reward = lru_cache(maxsize=4096)(self.calculate_pool_reward)
+
     @property
     def k(self):
         return self._k
@@ -28,6 +55,32 @@ class RSS:
     def calculate_pool_reward(self, pool_pledge, pool_stake):
         raise NotImplementedError("RSS subclass must implement 'calculate_pool_reward' method.")
 
+    def calculate_potential_profit(self, pool_pledge, pool_cost):
+        """
+        Calculate a pool's potential profit, which can be defined as the profit it would get at saturation level
+        (see also cached_potential_profit, which caches the results)
+        @param pool_pledge: the pledge of the pool
+        @param pool_cost: the cost of the pool
+        @return: the maximum possible profit that the pool can yield, aka its profit at saturation
+        """
+        potential_reward = self.calculate_pool_reward(
+            pool_pledge=pool_pledge, pool_stake=self.get_pool_saturation_threshold(pool_pledge)
+        )
+        return potential_reward - pool_cost
+
+    def calculate_pool_rewards(self, pool_pledges, pool_stakes):
+        """
+        Calculate the rewards of multiple pools at once. By default, this calls 'calculate_pool_reward' for each pool,
+        but subclasses can override it with an implementation that operates on whole arrays.
+        @param pool_pledges: numpy array with the pledges of the pools
+        @param pool_stakes: numpy array with the stakes of the pools
+        @return: numpy array with the rewards of the pools
+        """
+        return np.array([
+            self.calculate_pool_reward(pool_pledge=pledge, pool_stake=stake)
+            for pledge, stake in zip(pool_pledges, pool_stakes)
+        ], dtype=float)
+
     def get_pool_saturation_threshold(self, pool_pledge):
         """
         By default, the saturation point of all pools is given by the global_saturation_threshold. However, some
@@ -38,42 +91,77 @@ class RSS:
         """
         return self.global_saturation_threshold
 
+    def get_pool_saturation_thresholds(self, pool_pledges):
+        """
+        Array version of 'get_pool_saturation_threshold'. Reward schemes that override the latter must also
+        override this method.
+        @param pool_pledges: numpy array with the pledges of the relevant pools
+        @return: numpy array with the saturation thresholds of pools with the given pledges
+        """
+        return np.full(len(pool_pledges), self.global_saturation_threshold)
+
 
 class CardanoRSS(RSS):
     def __init__(self, k, a0):
         super().__init__(k=k, a0=a0)
 
     def calculate_pool_reward(self, pool_pledge, pool_stake):
-        pledge_ = min(pool_pledge, self.global_saturation_threshold)
-        stake_ = min(pool_stake, self.global_saturation_threshold)
+        # conditional expressions are used to cap the values instead of min(), as this method is called in the hot
+        # path of the simulation and they avoid the overhead of a function call (the results are the same)
+        saturation_threshold = self.global_saturation_threshold
+        pledge_ = saturation_threshold if pool_pledge > saturation_threshold else pool_pledge
+        stake_ = saturation_threshold if pool_stake > saturation_threshold else pool_stake
         r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * \
             (stake_ + (pledge_ * self.a0 * ((stake_ - pledge_ * (1 - stake_ / self.global_saturation_threshold))
                                             / self.global_saturation_threshold)))
         return r
 
+    def calculate_pool_rewards(self, pool_pledges, pool_stakes):
+        pledges_ = np.minimum(pool_pledges, self.global_saturation_threshold)
+        stakes_ = np.minimum(pool_stakes, self.global_saturation_threshold)
+        r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * \
+            (stakes_ + (pledges_ * self.a0 * ((stakes_ - pledges_ * (1 - stakes_ / self.global_saturation_threshold))
+                                              / self.global_saturation_threshold)))
+        return r
+
 
 class SimplifiedRSS(RSS):
     def __init__(self, k, a0):
         super().__init__(k=k, a0=a0)
 
     def calculate_pool_reward(self, pool_pledge, pool_stake):
-        pledge_ = min(pool_pledge, self.global_saturation_threshold)
-        stake_ = min(pool_stake, self.global_saturation_threshold)
+        saturation_threshold = self.global_saturation_threshold
+        pledge_ = saturation_threshold if pool_pledge > saturation_threshold else pool_pledge
+        stake_ = saturation_threshold if pool_stake > saturation_threshold else pool_stake
         r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * stake_ * \
             (1 + (self.a0 * pledge_ / self.global_saturation_threshold))
         return r
 
+    def calculate_pool_rewards(self, pool_pledges, pool_stakes):
+        pledges_ = np.minimum(pool_pledges, self.global_saturation_threshold)
+        stakes_ = np.minimum(pool_stakes, self.global_saturation_threshold)
+        r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * stakes_ * \
+            (1 + (self.a0 * pledges_ / self.global_saturation_threshold))
+        return r
+
 
 class FlatPledgeBenefitRSS(RSS):
     def __init__(self, k, a0):
         super().__init__(k=k, a0=a0)
 
     def calculate_pool_reward(self, pool_pledge, pool_stake):
-        pledge_ = min(pool_pledge, self.global_saturation_threshold)
-        stake_ = min(pool_stake, self.global_saturation_threshold)
+        saturation_threshold = self.global_saturation_threshold
+        pledge_ = saturation_threshold if pool_pledge > saturation_threshold else pool_pledge
+        stake_ = saturation_threshold if pool_stake > saturation_threshold else pool_stake
         r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * (stake_ + self.a0 * pledge_)
         return r
 
+    def calculate_pool_rewards(self, pool_pledges, pool_stakes):
+        pledges_ = np.minimum(pool_pledges, self.global_saturation_threshold)
+        stakes_ = np.minimum(pool_stakes, self.global_saturation_threshold)
+        r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * (stakes_ + self.a0 * pledges_)
+        return r
+
 
 class CurvePledgeBenefitRSS(RSS):  # CIP-7
     def __init__(self, k, a0, crossover_factor, curve_root):
@@ -85,13 +173,25 @@ class CurvePledgeBenefitRSS(RSS):  # CIP-7
         crossover = self.global_saturation_threshold / self.crossover_factor
         pledge_factor = (pool_pledge ** (1 / self.curve_root)) * (
                     crossover ** ((self.curve_root - 1) / self.curve_root))
-        pledge_ = min(pledge_factor, self.global_saturation_threshold)
-        stake_ = min(pool_stake, self.global_saturation_threshold)
+        saturation_threshold = self.global_saturation_threshold
+        pledge_ = saturation_threshold if pledge_factor > saturation_threshold else pledge_factor
+        stake_ = saturation_threshold if pool_stake > saturation_threshold else pool_stake
         r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * \
             (stake_ + (pledge_ * self.a0 * ((stake_ - pledge_ * (1 - stake_ / self.global_saturation_threshold))
                                             / self.global_saturation_threshold)))
         return r
 
+    def calculate_pool_rewards(self, pool_pledges, pool_stakes):
+        crossover = self.global_saturation_threshold / self.crossover_factor
+        pledge_factors = (pool_pledges ** (1 / self.curve_root)) * (
+                    crossover ** ((self.curve_root - 1) / self.curve_root))
+        pledges_ = np.minimum(pledge_factors, self.global_saturation_threshold)
+        stakes_ = np.minimum(pool_stakes, self.global_saturation_threshold)
+        r = (TOTAL_EPOCH_REWARDS_R / (1 + self.a0)) * \
+            (stakes_ + (pledges_ * self.a0 * ((stakes_ - pledges_ * (1 - stakes_ / self.global_saturation_threshold))
+                                              / self.global_saturation_threshold)))
+        return r
+
 
 class CIP50RSS(RSS):
     """
@@ -108,12 +208,23 @@ class CIP50RSS(RSS):
 
     def calculate_pool_reward(self, pool_pledge, pool_stake):
         pool_saturation_threshold = self.get_pool_saturation_threshold(pool_pledge)
-        r = TOTAL_EPOCH_REWARDS_R * min(pool_stake, pool_saturation_threshold)
+        r = TOTAL_EPOCH_REWARDS_R * (pool_saturation_threshold if pool_stake > pool_saturation_threshold else pool_stake)
+        return r
+
+    def calculate_pool_rewards(self, pool_pledges, pool_stakes):
+        pool_saturation_thresholds = self.get_pool_saturation_thresholds(pool_pledges)
+        r = TOTAL_EPOCH_REWARDS_R * np.minimum(pool_stakes, pool_saturation_thresholds)
         return r
 
     def get_pool_saturation_threshold(self, pool_pledge):
         custom_saturation_threshold = self.a0 * pool_pledge
-        return min(custom_saturation_threshold, self.global_saturation_threshold)
+        global_saturation_threshold = self.global_saturation_threshold
+        return global_saturation_threshold if custom_saturation_threshold > global_saturation_threshold \
+            else custom_saturation_threshold
+
+    def get_pool_saturation_thresholds(self, pool_pledges):
+        custom_saturation_thresholds = self.a0 * np.asarray(pool_pledges)
+        return np.minimum(custom_saturation_thresholds, self.global_saturation_threshold)
 
 
 RSS_MAPPING = {
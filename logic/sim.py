@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import time
+import os
 import pathlib
 import math
 import random
 import pickle as pkl
+import gzip
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
 import numpy as np
+import pandas as pd
 from sortedcontainers import SortedList
 from mesa import Model
 from mesa.datacollection import DataCollector
@@ -16,6 +22,8 @@ import logic.model_reporters as reporters
 import logic.stakeholder_profiles as profiles
 import logic.reward_schemes as rss
 
+STATUS_UPDATE_FREQUENCY = 50  # how often (in steps) the status of the simulation is printed when not in verbose mode
+
 
 class Simulation(Model):
     def __init__(
@@ -24,17 +32,28 @@ class Simulation(Model):
             absolute_utility_threshold=0, seed=None, pareto_param=2.0, max_iterations=1000, cost_min=1e-5,
             cost_max=1e-4, extra_pool_cost_fraction=0.4, agent_activation_order="random",
             iterations_after_convergence=10, reward_scheme=0, execution_id='', seq_id=-1, parent_dir='',
-            metrics=None, generate_graphs=True, input_from_file=False
+            metrics=None, generate_graphs=True, save_pickle=False, verbose=False, input_from_file=False
     ):
         if input_from_file:
             args = hlp.read_args_from_file("args.json")
+            # args files of earlier executions don't include the options that were added later
+            args.setdefault('save_pickle', save_pickle)
+            args.setdefault('verbose', verbose)
         else:
-            args = {}
-            args.update(locals())  # keep all input arguments in a dictionary
-            args.pop('self')
-            args.pop('__class__')
-            args.pop('input_from_file')
-            args.pop('args')
+            # keep all input arguments in a dictionary (note that the order matters, as the first few arguments are
+            # used to generate the execution id)
+            args = dict(
+                n=n, k=k, a0=a0, stake_distr_source=stake_distr_source, agent_profile_distr=agent_profile_distr,
+                inactive_stake_fraction=inactive_stake_fraction,
+                inactive_stake_fraction_known=inactive_stake_fraction_known,
+                relative_utility_threshold=relative_utility_threshold,
+                absolute_utility_threshold=absolute_utility_threshold, seed=seed, pareto_param=pareto_param,
+                max_iterations=max_iterations, cost_min=cost_min, cost_max=cost_max,
+                extra_pool_cost_fraction=extra_pool_cost_fraction, agent_activation_order=agent_activation_order,
+                iterations_after_convergence=iterations_after_convergence, reward_scheme=reward_scheme,
+                execution_id=execution_id, seq_id=seq_id, parent_dir=parent_dir, metrics=metrics,
+                generate_graphs=generate_graphs, save_pickle=save_pickle, verbose=verbose
+            )
         if args['metrics'] is None:
             args['metrics'] = [1, 2, 6, 9, 17, 18, 25]
         if args['agent_profile_distr'] is None:
@@ -71,7 +90,7 @@ class Simulation(Model):
 
         other_fields = [
             'n', 'k', 'a0', 'relative_utility_threshold', 'absolute_utility_threshold', 'max_iterations',
-            'extra_pool_cost_fraction', 'agent_activation_order', 'generate_graphs'
+            'extra_pool_cost_fraction', 'agent_activation_order', 'generate_graphs', 'save_pickle', 'verbose'
         ]
         multi_phase_params = {}
         for field in other_fields:
@@ -130,8 +149,12 @@ class Simulation(Model):
 
         self.consecutive_idle_steps = 0  # steps towards convergence
         self.current_step_idle = True
+        self.idle_since_data_collection = False  # True if the state of the system hasn't changed since the last collection
         self.iterations_after_convergence = args['iterations_after_convergence']
         self.pools = dict()
+        self.top_pools_cache = dict()  # pool id -> whether the pool ranks in the top pools (see is_pool_in_top_pools)
+        self.pools_state_version = 0  # incremented whenever the state of the pools changes (see register_pools_change)
+        self.agent_ranks_cache = dict()  # (attribute, descending) -> ranks of the agents (see get_agent_ranks)
         # self.revision_frequency = 10  # defines how often agents revise their belief about the active stake and expected #pools
         self.initialize_pool_id_seq()  # initialize pool id sequence for the new model run
 
@@ -157,22 +180,26 @@ class Simulation(Model):
             stake_distribution = hlp.generate_stake_distr_flat(num_agents=self.n)
         elif stake_distr_source == 'disparity':
             stake_distribution = hlp.generate_stake_distr_disparity(n=self.n)
-        total_stake = sum(stake_distribution)
 
         # Allocate cost to the agents, sampling from a uniform distribution
         cost_distribution = hlp.generate_cost_distr_unfrm(num_agents=self.n, low=cost_min, high=cost_max, seed=seed)
 
+        # The stake and cost of the agents don't change during the simulation, so we also keep them in arrays
+        # (indexed by agent id) that can be used for vectorised calculations
+        self.agent_stakes = np.array(stake_distribution, dtype=float)
+        self.agent_costs = np.array(cost_distribution, dtype=float)
+        # sum sequentially (numpy uses pairwise summation, which would give slightly different normalised stakes)
+        total_stake = sum(self.agent_stakes.tolist())
+
         agent_profiles = self.random.choices(list(profiles.PROFILE_MAPPING.keys()), k=self.n,
                                              weights=agent_profile_distr)
-        for i in range(self.n):
-            agent_type = profiles.PROFILE_MAPPING[agent_profiles[i]]
-            agent = agent_type(
-                unique_id=i,
-                model=self,
-                stake=stake_distribution[i],
-                cost=cost_distribution[i]
-            )
+        # agents are not added or removed during the simulation, so the mapping of ids to agents is only built once
+        self._agents_by_id = {}
+        for i, (agent_profile, stake, cost) in enumerate(zip(agent_profiles, stake_distribution, cost_distribution)):
+            agent_type = profiles.PROFILE_MAPPING[agent_profile]
+            agent = agent_type(unique_id=i, model=self, stake=stake, cost=cost)
             self.schedule.add(agent)
+            self._agents_by_id[i] = agent
         return total_stake
 
     def normalize_agent_stake(self, total_stake):
@@ -180,34 +207,38 @@ class Simulation(Model):
         Normalize agent stakes so that the total stake of the system is equal to 1.
         @param total_stake: the total stake of the system prior to normalization (including agent stake and inactive stake)
         """
-        norm_total_stake = 0
-        for agent in self.schedule.agents:
-            agent.stake /= total_stake
-            norm_total_stake += agent.stake
+        agent_stakes = self.agent_stakes
+        agent_stakes /= total_stake
+        # sum sequentially (numpy uses pairwise summation) so that the floating point error correction below gives
+        # the same stake values as when adding up the stakes agent by agent
+        norm_total_stake = sum(agent_stakes.tolist())
         if norm_total_stake != 1:
             # add (or subtract) tiny value from the last agent's stake to account for floating point errors and make
             # sure that the sum of all agent stakes is equal to 1
             flt_error = 1 - norm_total_stake
-            agent.stake += flt_error
+            agent_stakes[-1] += flt_error
             norm_total_stake += flt_error
+        for agent, stake in zip(self.schedule.agents, agent_stakes.tolist()):
+            agent.stake = stake
         return norm_total_stake
 
     def initialize_pool_id_seq(self):
-        self.id_seq = 0
+        self.next_pool_id = 1
 
     def get_next_pool_id(self):
-        self.id_seq += 1
-        return self.id_seq
+        pool_id = self.next_pool_id
+        self.next_pool_id += 1
+        return pool_id
 
     def rewind_pool_id_seq(self, step=1):
-        self.id_seq -= step
+        self.next_pool_id -= step
 
     def step(self):
         """
         Execute one step of the simulation
         """
         self.get_status()
-        self.datacollector.collect(self)
+        self.collect_data()
 
         current_step = self.schedule.steps
         if current_step >= self.max_iterations:
@@ -229,8 +260,24 @@ class Simulation(Model):
                     return
         else:
             self.consecutive_idle_steps = 0
+            self.idle_since_data_collection = False
         self.current_step_idle = True
 
+    def collect_data(self):
+        """
+        Collect the values of the tracked metrics for the current step. If the state of the system hasn't changed since
+        the last collection (i.e. no agent moved in the meantime), then the previous values are reused for all metrics
+        except for the ones that depend on the step itself
+        """
+        datacollector = self.datacollector
+        if not self.idle_since_data_collection:
+            datacollector.collect(self)
+        else:
+            for name, reporter in datacollector.model_reporters.items():
+                values = datacollector.model_vars[name]
+                values.append(reporter(self) if name in reporters.STEP_DEPENDENT_REPORTERS else values[-1])
+        self.idle_since_data_collection = True
+
     def run_model(self):
         """
         Execute multiple steps of the simulation, until it converges or a maximum number of iterations is reached
@@ -241,6 +288,30 @@ class Simulation(Model):
         while self.schedule.steps <= self.max_iterations and self.running:
             self.step()
 
+    @classmethod
+    def run_batch(cls, seed_list, max_workers=None, **kwargs):
+        """
+        Execute independent runs of the simulation, one for each of the given seeds, in parallel processes
+        (one per core by default). All runs use the same parameter values, which are passed as keyword arguments.
+        @param seed_list: the seeds to use for the different runs (must not contain duplicates)
+        @param max_workers: the maximum number of processes to use (defaults to the number of cores of the machine)
+        @return: dictionary with the seed as the key and the metrics DataFrame of the corresponding run as the value
+        """
+        if len(set(seed_list)) < len(seed_list):
+            # runs with the same seed give the same results, and only one of them could be returned
+            raise ValueError('the seeds of a batch run must be unique')
+        if max_workers is None:
+            max_workers = os.cpu_count()
+        # reserve the sequence ids here, as the worker processes can't safely share the sequence file
+        first_seq_id = hlp.read_seq_id() + 1
+        hlp.write_seq_id(first_seq_id + len(seed_list) - 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                seed: executor.submit(_run_simulation, cls, kwargs | {'seed': seed, 'seq_id': first_seq_id + i})
+                for i, seed in enumerate(seed_list)
+            }
+            return {seed: future.result() for seed, future in futures.items()}
+
     def has_converged(self):
         """
         Check whether the system has reached a state of equilibrium,
@@ -272,49 +343,66 @@ class Simulation(Model):
         hlp.export_json_file(descriptors, filepath)
 
     def export_agents_file(self):
-        row_list = [
-            ["Agent id", "Initial stake", "Cost", "Potential Profit", "Status", "Pools owned", "Total pool stake",
-             "Pool splitting profit", "Profitable pool splitter"]]
-        agents = self.get_agents_dict()
+        agents = self.get_agents_list()
+        stakes = self.agent_stakes
+        costs = self.agent_costs
+        potential_profits = hlp.calculate_potential_profits(
+            reward_scheme=self.reward_scheme, pledges=stakes, costs=costs
+        )
+        pool_splitting_profits = hlp.calculate_pool_splitting_profit(
+            self.reward_scheme.a0, self.extra_pool_cost_fraction, costs, stakes
+        )
+        is_abstainer = np.array([agent.strategy is None for agent in agents], dtype=bool)
+        pools_owned = np.array([
+            0 if agent.strategy is None else len(agent.strategy.owned_pools) for agent in agents
+        ], dtype=int)
+        total_pool_stakes = np.array([
+            0 if agent.strategy is None else sum([pool.stake for pool in agent.strategy.owned_pools.values()])
+            for agent in agents
+        ], dtype=float)
+
         decimals = 15
-        row_list.extend([
-            [agent_id, round(agents[agent_id].stake, decimals), round(agents[agent_id].cost, decimals),
-             round(hlp.calculate_potential_profit(reward_scheme=self.reward_scheme, pledge=agents[agent_id].stake,
-                                                  cost=agents[agent_id].cost), decimals),
-             "Abstainer" if agents[agent_id].strategy is None else "Operator" if len(
-                 agents[agent_id].strategy.owned_pools) > 0 else "Delegator",
-             0 if agents[agent_id].strategy is None else len(agents[agent_id].strategy.owned_pools),
-             0 if agents[agent_id].strategy is None else sum(
-                 [pool.stake for pool in agents[agent_id].strategy.owned_pools.values()]),
-             hlp.calculate_pool_splitting_profit(self.reward_scheme.a0, self.extra_pool_cost_fraction,
-                                                 agents[agent_id].cost, agents[agent_id].stake),
-             "YES" if hlp.calculate_pool_splitting_profit(self.reward_scheme.a0, self.extra_pool_cost_fraction,
-                                                          agents[agent_id].cost, agents[agent_id].stake) > 0 else "NO"
-             ] for agent_id in range(len(agents))
-        ])
+        df = pd.DataFrame({
+            "Agent id": [agent.unique_id for agent in agents],
+            "Initial stake": stakes.round(decimals),
+            "Cost": costs.round(decimals),
+            "Potential Profit": potential_profits.round(decimals),
+            "Status": np.where(is_abstainer, "Abstainer", np.where(pools_owned > 0, "Operator", "Delegator")),
+            "Pools owned": pools_owned,
+            "Total pool stake": total_pool_stakes,
+            "Pool splitting profit": pool_splitting_profits,
+            "Profitable pool splitter": np.where(pool_splitting_profits > 0, "YES", "NO")
+        })
 
         prefix = 'final-state-stakeholders-'
         filename = prefix + self.execution_id + '.csv'
         filepath = self.directory / filename
-        hlp.export_csv_file(row_list, filepath)
+        df.to_csv(filepath, index=False)
 
     def export_pools_file(self):
-        row_list = [["Pool id", "Owner id", "Owner stake", "Pool Pledge", "Pool stake", "Owner cost", "Pool cost",
-                     "Pool margin", "Pool PP", "Pool desirability"]]
-        agents = self.get_agents_dict()
         pools = self.get_pools_list()
+        owners = np.array([pool.owner for pool in pools], dtype=int)
         decimals = 15
-        row_list.extend(
-            [[pool.id, pool.owner, round(agents[pool.owner].stake, decimals), round(pool.pledge, decimals),
-              round(pool.stake, decimals), round(agents[pool.owner].cost, decimals), round(pool.cost, decimals),
-              round(pool.margin, decimals), pool.potential_profit, pool.desirability] for pool in pools])
+        df = pd.DataFrame({
+            "Pool id": [pool.id for pool in pools],
+            "Owner id": owners,
+            "Owner stake": self.agent_stakes[owners].round(decimals),
+            "Pool Pledge": np.array([pool.pledge for pool in pools], dtype=float).round(decimals),
+            "Pool stake": np.array([pool.stake for pool in pools], dtype=float).round(decimals),
+            "Owner cost": self.agent_costs[owners].round(decimals),
+            "Pool cost": np.array([pool.cost for pool in pools], dtype=float).round(decimals),
+            "Pool margin": np.array([pool.margin for pool in pools], dtype=float).round(decimals),
+            "Pool PP": [pool.potential_profit for pool in pools],
+            "Pool desirability": [pool.desirability for pool in pools]
+        })
         prefix = 'final-state-pools-'
         filename = prefix + self.execution_id + '.csv'
         filepath = self.directory / filename
-        hlp.export_csv_file(row_list, filepath)
+        df.to_csv(filepath, index=False)
 
-    def export_metrics_file(self):
-        df = self.datacollector.get_model_vars_dataframe()
+    def export_metrics_file(self, df=None):
+        if df is None:
+            df = self.datacollector.get_model_vars_dataframe()
         filename = 'metrics.csv'
         filepath = self.directory / filename
         df.to_csv(filepath, index_label='Round')
@@ -346,12 +434,13 @@ class Simulation(Model):
         hlp.write_to_csv(filepath, header, row)
 
     def save_model_state_pkl(self):
-        filename = "simulation-object.pkl"
+        filename = "simulation-object.pkl.gz"
         pickled_simulation_filepath = self.directory / filename
-        with open(pickled_simulation_filepath, "wb") as pkl_file:
-            pkl.dump(self, pkl_file)
+        # low compression level, as the aim is to cut down the size of the file without spending much time on it
+        with gzip.open(pickled_simulation_filepath, "wb", compresslevel=1) as pkl_file:
+            pkl.dump(self, pkl_file, protocol=pkl.HIGHEST_PROTOCOL)
 
-    def export_graphs(self):
+    def export_graphs(self, df=None):
         figures_dir = self.directory / "figures"
         pathlib.Path(figures_dir).mkdir(parents=True, exist_ok=True)
 
@@ -363,35 +452,96 @@ class Simulation(Model):
         all_reporter_colours["Total pledge"] = 'purple'
         all_reporter_colours["Nakamoto coefficient"] = 'pink'  # todo maybe remove custom colors
 
-        df = self.datacollector.get_model_vars_dataframe()
+        if df is None:
+            df = self.datacollector.get_model_vars_dataframe()
         if len(df) > 0:
+            plots = []
             for col in df.columns:
                 if isinstance(df[col][0], list):
-                    hlp.plot_stack_area_chart(
+                    plots.append((hlp.plot_stack_area_chart, dict(
                         pool_sizes_by_step=df[col], execution_id=self.execution_id, path=figures_dir
-                    )
+                    )))
                 elif isinstance(df[col][0], dict):
                     pass
                 else:
-                    hlp.plot_line(
+                    plots.append((hlp.plot_line, dict(
                         data=df[col], execution_id=self.execution_id, color=all_reporter_colours[col], title=col,
                         x_label="Round", y_label=col, filename=col, equilibrium_steps=self.equilibrium_steps,
                         pivot_steps=self.pivot_steps, path=figures_dir, show_equilibrium=True
-                    )
+                    )))
+            if len(plots) == 0:
+                return
+            # the figures are independent of each other, so they are drawn in separate processes, unless the simulation
+            # itself runs in a child process (e.g. a worker of run_batch or custom_batch_run). The cores are already
+            # used by the other runs of the batch then (and daemonic processes are not allowed to have children anyway)
+            max_workers = min(len(plots), os.cpu_count() or 1)
+            if max_workers == 1 or multiprocessing.parent_process() is not None:
+                for plot_function, plot_kwargs in plots:
+                    plot_function(**plot_kwargs)
+                return
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_plotting_worker) as executor:
+                futures = [executor.submit(plot_function, **plot_kwargs) for plot_function, plot_kwargs in plots]
+                for future in futures:
+                    future.result()  # propagate any errors that occurred while plotting
+
+    def is_pool_in_top_pools(self, pool):
+        """
+        Check whether a pool ranks in the top pools of the system's (non-myopic) pool rankings. The result only depends
+        on the rankings, so it is cached until they change (see clear_top_pools_cache)
+        @param pool: a pool that is part of self.pool_rankings
+        """
+        cache = self.top_pools_cache
+        if pool.id not in cache:
+            cache[pool.id] = hlp.is_pool_in_top_pools(
+                pool=pool, pool_rankings=self.pool_rankings, reward_scheme=self.reward_scheme,
+                total_stake=self.total_stake
+            )
+        return cache[pool.id]
+
+    def clear_top_pools_cache(self):
+        """
+        Discard the cached results of is_pool_in_top_pools (to be used whenever self.pool_rankings changes)
+        """
+        self.top_pools_cache.clear()
+
+    def register_pools_change(self):
+        """
+        Mark that the state of the pools (or of the parameters that their rewards depend on) has changed, so that any
+        results that were calculated based on the previous state are not reused
+        """
+        self.pools_state_version += 1
 
     def get_pools_list(self):
         return list(self.pools.values())
 
+    def get_agent_ranks(self, attribute, descending=True):
+        """
+        Rank the agents based on one of their attributes (e.g. their stake). The stake and cost of the agents don't
+        change during the simulation, so the ranks are only calculated once
+        @param attribute: the name of the agent attribute to rank the agents by
+        @param descending: if True then the agent with the highest value gets rank 1, otherwise the agent with the
+                        lowest value gets rank 1
+        @return: dictionary with the agent id as the key and the agent's rank as the value
+        """
+        cache_key = (attribute, descending)
+        if cache_key not in self.agent_ranks_cache:
+            sign = 1 if descending else -1
+            self.agent_ranks_cache[cache_key] = hlp.calculate_ranks({
+                agent_id: sign * getattr(agent, attribute) for agent_id, agent in self.get_agents_dict().items()
+            })
+        return self.agent_ranks_cache[cache_key]
+
     def get_agents_dict(self):
-        return {agent.unique_id: agent for agent in self.schedule.agents}
+        assert len(self._agents_by_id) == self.schedule.get_agent_count()
+        return self._agents_by_id
 
     def get_agents_list(self):
         return self.schedule.agents
 
-    # todo add verbosity levels (or at least verbose and non-verbose version)
     def get_status(self):
-        print("Step {}: {} pools"
-              .format(self.schedule.steps, len(self.pools)))
+        if self.verbose or self.schedule.steps % STATUS_UPDATE_FREQUENCY == 0:
+            print("Step {}: {} pools"
+                  .format(self.schedule.steps, len(self.pools)))
 
     def revise_beliefs(self):  # currently not used
         """
@@ -407,6 +557,8 @@ class Simulation(Model):
         # Revise expected number of pools, k  (note that the value of global_saturation_threshold, which is used to
         # calculate rewards, does not change in this case)
         self.reward_scheme.k = math.ceil(round(active_stake / self.reward_scheme.global_saturation_threshold, 12))  # first rounding to 12 decimal digits to avoid floating point errors
+        self.clear_top_pools_cache()
+        self.register_pools_change()
         # todo if we keep method then make sure that the change of rss params is properly followed by changes in potential profits etc (see method below)
 
     def change_phase(self):
@@ -422,11 +574,15 @@ class Simulation(Model):
                     instance = self.reward_scheme
                 setattr(instance, key, values[self.current_phase])
                 change_occured = True
+        if change_occured:
+            self.idle_since_data_collection = False
         for pool in self.pools.values():
             pool.set_profit(reward_scheme=self.reward_scheme)
             pool.set_desirability()
             self.pool_rankings.add(pool)
             self.pool_rankings_myopic.add(pool)
+        self.clear_top_pools_cache()
+        self.register_pools_change()
         if change_occured:
             self.pivot_steps.append(self.schedule.steps)
 
@@ -435,20 +591,31 @@ class Simulation(Model):
         print("Execution {} took  {:.2f} seconds to run.".format(self.execution_id, time.time() - self.start_time))
         self.export_pools_file()
         self.export_agents_file()
-        self.export_metrics_file()
+        # the metrics dataframe is built from the collected values on every call, so it's only built once here
+        metrics_df = self.datacollector.get_model_vars_dataframe()
+        self.export_metrics_file(metrics_df)
         self.export_final_state_desc_file()
         self.append_to_experiment_tracker()
-        self.save_model_state_pkl()
+        if self.save_pickle:
+            self.save_model_state_pkl()
         if self.generate_graphs:
-            self.export_graphs()
+            self.export_graphs(metrics_df)
 
     def pool_comparison_key_myopic(self, pool):
         if pool is None:
             return 0, 0, 0
         # sort pools based on their myopic desirability
         # break ties with pool id
-        current_profit = hlp.calculate_current_profit(
-            pool.stake, pool.pledge, pool.cost, self.reward_scheme
-        )
-        myopic_desirability = hlp.calculate_myopic_pool_desirability(pool.margin, current_profit)
-        return -myopic_desirability, pool.id
+        return -pool.get_myopic_desirability(self.reward_scheme), pool.id
+
+
+def _run_simulation(model_cls, kwargs):
+    # module-level function so that it can be pickled and sent to the worker processes of Simulation.run_batch
+    model = model_cls(**kwargs)
+    model.run_model()
+    return model.datacollector.get_model_vars_dataframe()
+
+
+def _init_plotting_worker():
+    # the worker processes of Simulation.export_graphs only save figures to files, so they use a non-interactive backend
+    matplotlib.use('Agg')
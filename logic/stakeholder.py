@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from mesa import Agent
-from copy import deepcopy
 import heapq
 import math
+from itertools import islice
 
 import logic.helper as hlp
 from logic.pool import Pool
@@ -10,6 +10,7 @@ from logic.strategy import Strategy
 
 
 class Stakeholder(Agent):
+    __slots__ = ['cost', 'stake', 'new_strategy', 'strategy', 'rankings', 'current_strategy_utilities_cache']
 
     def __init__(self, unique_id, model, stake, cost, strategy=None):
         super().__init__(unique_id, model)
@@ -20,6 +21,7 @@ class Stakeholder(Agent):
             # Initialize strategy to an "empty" strategy
             strategy = Strategy()
         self.strategy = strategy
+        self.current_strategy_utilities_cache = None
 
     def calculate_operator_utility_from_strategy(self, strategy):
         raise NotImplementedError(
@@ -31,11 +33,27 @@ class Stakeholder(Agent):
             "Stakeholder subclass must implement 'calculate_delegator_utility_from_pool' method."
         )
 
-    def calculate_margins_and_utility(self, num_pools):
+    def calculate_margins_and_utility(self, num_pools, target_desirabilities=None):
         raise NotImplementedError(
             "Stakeholder subclass must implement 'calculate_margins_and_utility' method."
         )
 
+    def calculate_target_desirabilities(self, fixed_pools_ranked):
+        raise NotImplementedError(
+            "Stakeholder subclass must implement 'calculate_target_desirabilities' method."
+        )
+
+    def rank_fixed_pools(self):
+        """
+        Find the best pools that don't belong to the agent (i.e. the ones that the agent's pools have to compete with)
+        Only the k best pools are relevant, so the rest of the rankings are not traversed
+        @return: list with the k best pools of other agents, ordered from best to worst (None for empty slots)
+        """
+        return list(islice(
+            (pool for pool in self.rankings if pool is None or pool.owner != self.unique_id),
+            self.model.reward_scheme.k
+        ))
+
     def step(self):
         self.update_strategy()
         if "simultaneous" not in self.model.agent_activation_order.lower():
@@ -51,8 +69,7 @@ class Stakeholder(Agent):
             self.model.current_step_idle = False
 
     def update_strategy(self):
-        current_utility = self.calculate_current_utility()
-        current_move_expected_utility = self.calculate_expected_utility(self.strategy)
+        current_utility, current_move_expected_utility = self.calculate_current_strategy_utilities()
         augmented_current_move_utility = max(
             (1 + self.model.relative_utility_threshold) * current_utility,
             current_utility + self.model.absolute_utility_threshold,
@@ -65,7 +82,13 @@ class Stakeholder(Agent):
         # For all agents, find a possible delegation strategy and calculate its potential utility
         # unless they are pool operators with recently opened pools (we assume that they will keep them at least for a bit)
         delegator_strategy = self.find_delegation_move()
-        delegator_utility = self.calculate_expected_utility(delegator_strategy)
+        if len(self.strategy.owned_pools) == 0 and \
+                delegator_strategy.stake_allocations == self.strategy.stake_allocations:
+            # the delegation move is the same as the current strategy, so it has the same expected utility and it can't
+            # be preferred over the current move (which also accounts for the utility thresholds)
+            delegator_utility = current_move_expected_utility
+        else:
+            delegator_utility = self.calculate_expected_utility(delegator_strategy)
         possible_moves["delegator"] = delegator_utility, delegator_strategy
         pool_strategy = self.choose_pool_strategy()
         if pool_strategy[1] is not None:
@@ -77,6 +100,18 @@ class Stakeholder(Agent):
         max_utility_option = max(possible_moves, key=lambda key: possible_moves[key][0])
         self.new_strategy = None if max_utility_option == "current" else possible_moves[max_utility_option][1]
 
+    def calculate_current_strategy_utilities(self):
+        """
+        Calculate the current and the expected utility of the agent's current strategy. These only depend on the
+        strategy and the state of the pools, so they are reused for as long as neither of them changes
+        @return: a tuple with the current utility and the expected utility of the current strategy
+        """
+        cache = self.current_strategy_utilities_cache
+        if cache is None or cache[0] != self.model.pools_state_version or cache[1] is not self.strategy:
+            utilities = self.calculate_current_utility(), self.calculate_expected_utility(self.strategy)
+            cache = self.current_strategy_utilities_cache = (self.model.pools_state_version, self.strategy, utilities)
+        return cache[2]
+
     def discard_draft_pools(self, operator_strategy):  # unused for now
         # Discard the pool ids that were used for the hypothetical operator move
         old_owned_pools = set(self.strategy.owned_pools.keys())
@@ -131,17 +166,29 @@ class Stakeholder(Agent):
         t_min = 1
         t_max = self.model.reward_scheme.k
         solution_found = False
+        # the search often revisits the same numbers of pools as it narrows down, so the results are kept
+        margins_and_utilities = dict()
+        # the rankings don't change during the search, so the pools to compete with (and the desirabilities that the
+        # agent's pools need to surpass them) are only determined once
+        target_desirabilities = self.calculate_target_desirabilities(self.rank_fixed_pools())
+
+        def get_margins_and_utility(num_pools):
+            if num_pools not in margins_and_utilities:
+                margins_and_utilities[num_pools] = self.calculate_margins_and_utility(
+                    num_pools=num_pools, target_desirabilities=target_desirabilities
+                )
+            return margins_and_utilities[num_pools]
 
         while not solution_found:
             t = math.floor((t_min + t_max) / 2)
-            margins_t, utility_t = self.calculate_margins_and_utility(num_pools=t)
+            margins_t, utility_t = get_margins_and_utility(t)
             if t > t_min:
-                margins_t_minus, utility_t_minus = self.calculate_margins_and_utility(num_pools=t - 1)
+                margins_t_minus, utility_t_minus = get_margins_and_utility(t - 1)
                 if utility_t_minus > utility_t:
                     t_max = t - 1
                     continue
             if t < t_max:
-                margins_t_plus, utility_t_plus = self.calculate_margins_and_utility(num_pools=t + 1)
+                margins_t_plus, utility_t_plus = get_margins_and_utility(t + 1)
                 if utility_t_plus > utility_t:
                     t_min = t + 1
                     continue  # checking only one of them suffices under the assumption that the function has one local max and is otherwise monotonincally increasing/decreasing
@@ -182,9 +229,9 @@ class Stakeholder(Agent):
                                self.strategy.owned_pools.items()]
             top_pools_ids = {-p[3] for p in heapq.nlargest(num_pools_to_keep, pool_properties)}
             for pool_id in top_pools_ids:
-                owned_pools_to_keep[pool_id] = deepcopy(self.strategy.owned_pools[pool_id])
+                owned_pools_to_keep[pool_id] = self.strategy.owned_pools[pool_id].copy()
         else:
-            owned_pools_to_keep = deepcopy(self.strategy.owned_pools)
+            owned_pools_to_keep = {pool_id: pool.copy() for pool_id, pool in self.strategy.owned_pools.items()}
         return owned_pools_to_keep
 
     def calculate_cost_per_pool(self, num_pools):
@@ -210,17 +257,30 @@ class Stakeholder(Agent):
         )
 
     def find_operator_move(self, num_pools, owned_pools, margins=[]):
+        reward_scheme = self.model.reward_scheme
         pledge = self.determine_pledge_per_pool(num_pools=num_pools)
         cost_per_pool = self.calculate_cost_per_pool(num_pools=num_pools)
+        # all pools of the strategy have the same pledge and cost, so whether they are private and their default margin
+        # (which only depends on these) are the same for all of them and only calculated once
+        is_private = pledge >= reward_scheme.get_pool_saturation_threshold(pledge)
+        default_margin = None
+
+        def get_margin(pool_index, pool):
+            nonlocal default_margin
+            if len(margins) > pool_index:
+                return margins[pool_index]
+            if default_margin is None:
+                default_margin = self.calculate_margin(pool)
+            return default_margin
 
         for i, (pool_id, pool) in enumerate(owned_pools.items()):
             # For pools that already exist, modify them to match the new strategy
             pool.stake -= pool.pledge - pledge
             pool.pledge = pledge
-            pool.is_private = pool.pledge >= self.model.reward_scheme.get_pool_saturation_threshold(pool.pledge)
+            pool.is_private = is_private
             pool.cost = cost_per_pool
-            pool.set_profit(reward_scheme=self.model.reward_scheme)
-            pool.margin = margins[i] if len(margins) > i else self.calculate_margin(pool)
+            pool.set_profit(reward_scheme=reward_scheme)
+            pool.margin = get_margin(i, pool)
 
         existing_pools_num = len(owned_pools)
         for i in range(existing_pools_num, num_pools):
@@ -228,11 +288,11 @@ class Stakeholder(Agent):
             pool_id = self.model.get_next_pool_id()
             pool = Pool(
                 pool_id=pool_id, cost=cost_per_pool, pledge=pledge, owner=self.unique_id,
-                reward_scheme=self.model.reward_scheme,
-                is_private=pledge >= self.model.reward_scheme.get_pool_saturation_threshold(pledge)
+                reward_scheme=reward_scheme,
+                is_private=is_private
             )
             # private pools have margin 0 but don't allow delegations
-            pool.margin = margins[i] if len(margins) > i else self.calculate_margin(pool)
+            pool.margin = get_margin(i, pool)
             owned_pools[pool_id] = pool
 
         allocations = self.find_delegation_for_operator(pledge * num_pools)
@@ -256,30 +316,31 @@ class Stakeholder(Agent):
         :stake_to_delegate: the amount of stake to delegate
         :return: a dictionary with delegation allocations {pool_id: stake_to_delegate_to_pool}
         """
-        all_pools_dict = self.model.pools
-        eligible_pools_ranked = [
-            pool
-            for pool in self.rankings
-            if pool is not None and pool.owner != self.unique_id and not pool.is_private
-        ]
-        # Only proceed if there are public pools in the system that don't belong to the current agent
-        if len(eligible_pools_ranked) == 0:
-            return None
-
-        # Remove the agent's stake from the pools in case it's being delegated
-        for pool_id, allocation in self.strategy.stake_allocations.items():
-            pool = all_pools_dict[pool_id]
-            self.model.pool_rankings_myopic.remove(pool)
-            pool.update_delegation(new_delegation=0, delegator_id=self.unique_id)
-            self.model.pool_rankings_myopic.add(pool)
+        current_allocations = self.strategy.stake_allocations
+        for pool_id, allocation in current_allocations.items():
+            pool = self.model.pools[pool_id]
+            if pool.delegators.get(self.unique_id) != allocation:
+                # the pool has lost track of the agent's delegation (possible when agents move (semi)simultaneously
+                # and an updated version of the pool that was drafted earlier replaces it), so it is registered again
+                self.model.pool_rankings_myopic.remove(pool)
+                pool.update_delegation(new_delegation=allocation, delegator_id=self.unique_id)
+                self.model.pool_rankings_myopic.add(pool)
+                self.model.register_pools_change()
 
+        # The agent's current delegations are not counted in the stake of the pools (as they would be withdrawn)
         allocations = dict()
         best_saturated_pool = None
-        while len(eligible_pools_ranked) > 0:
+        eligible_pool_found = False
+        # the rankings are already sorted, so the pools are visited lazily and only until the stake has been allocated
+        for best_pool in self.rankings:
+            if best_pool is None or best_pool.owner == self.unique_id or best_pool.is_private:
+                continue
+            eligible_pool_found = True
             # first attempt to delegate to unsaturated pools
-            best_pool = eligible_pools_ranked.pop(0)
             saturation_threshold = self.model.reward_scheme.get_pool_saturation_threshold(best_pool.pledge)
-            stake_to_saturation = saturation_threshold - best_pool.stake
+            pool_stake = best_pool.stake - current_allocations[best_pool.id] \
+                if best_pool.id in current_allocations else best_pool.stake
+            stake_to_saturation = saturation_threshold - pool_stake
             if stake_to_saturation < hlp.MIN_STAKE_UNIT:
                 if best_saturated_pool is None:
                     best_saturated_pool = best_pool
@@ -289,17 +350,13 @@ class Stakeholder(Agent):
             allocations[best_pool.id] = allocation
             if stake_to_delegate < hlp.MIN_STAKE_UNIT:
                 break
+        # No delegation is possible if there are no public pools in the system that don't belong to the current agent
+        if not eligible_pool_found:
+            return None
         if stake_to_delegate >= hlp.MIN_STAKE_UNIT and best_saturated_pool is not None:
             #  if the stake to delegate does not fit in unsaturated pools, delegate to the saturated one with the
             #  highest desirability
             allocations[best_saturated_pool.id] = stake_to_delegate
-
-        # Return the agent's stake to the pools it was delegated to
-        for pool_id, allocation in self.strategy.stake_allocations.items():
-            pool = all_pools_dict[pool_id]
-            self.model.pool_rankings_myopic.remove(pool)
-            pool.update_delegation(new_delegation=allocation, delegator_id=self.unique_id)
-            self.model.pool_rankings_myopic.add(pool)
         return allocations
 
     def find_delegation_move(self, stake_to_delegate=None):
@@ -319,19 +376,17 @@ class Stakeholder(Agent):
         current_pools = self.model.pools
         old_allocations = self.strategy.stake_allocations
         new_allocations = self.new_strategy.stake_allocations
-        for pool_id in old_allocations.keys() - new_allocations.keys():
-            pool = current_pools[pool_id]
-            if pool is not None:
-                # remove delegation
-                self.model.pool_rankings_myopic.remove(pool)
-                pool.update_delegation(new_delegation=0, delegator_id=self.unique_id)
-                self.model.pool_rankings_myopic.add(pool)
-        for pool_id in new_allocations.keys():
+        # delegations that are no longer part of the strategy are set to 0 (i.e. removed)
+        allocation_changes = {
+            pool_id: new_allocations.get(pool_id, 0) for pool_id in old_allocations.keys() | new_allocations.keys()
+        }
+        for pool_id, allocation in allocation_changes.items():
             pool = current_pools[pool_id]
-            if pool is not None:
-                # add / modify delegation
+            # skip the pools that already hold exactly this delegation from the agent
+            if pool is not None and pool.delegators.get(self.unique_id, 0) != allocation:
+                # add / modify / remove delegation
                 self.model.pool_rankings_myopic.remove(pool)
-                pool.update_delegation(new_delegation=new_allocations[pool_id], delegator_id=self.unique_id)
+                pool.update_delegation(new_delegation=allocation, delegator_id=self.unique_id)
                 self.model.pool_rankings_myopic.add(pool)
 
         old_owned_pools = set(self.strategy.owned_pools.keys())
@@ -348,6 +403,7 @@ class Stakeholder(Agent):
         self.new_strategy = None
         for pool_id in new_owned_pools - old_owned_pools:
             self.open_pool(pool_id)
+        self.model.register_pools_change()
 
     def update_pool(self, pool_id):
         updated_pool = self.new_strategy.owned_pools[pool_id]
@@ -359,6 +415,7 @@ class Stakeholder(Agent):
         old_pool = self.strategy.owned_pools[pool_id]
         self.model.pool_rankings.remove(old_pool)
         self.model.pool_rankings.add(updated_pool)
+        self.model.clear_top_pools_cache()
         self.model.pool_rankings_myopic.remove(old_pool)
         self.model.pool_rankings_myopic.add(updated_pool)
         return updated_pool
@@ -368,6 +425,7 @@ class Stakeholder(Agent):
         self.model.pools[pool_id] = pool
         # include in pool rankings
         self.model.pool_rankings.add(pool)
+        self.model.clear_top_pools_cache()
         self.model.pool_rankings_myopic.add(pool)
 
     def close_pool(self, pool_id):
@@ -375,6 +433,7 @@ class Stakeholder(Agent):
         pool = pools[pool_id]
         # remove from top k desirabilities
         self.model.pool_rankings.remove(pool)
+        self.model.clear_top_pools_cache()
         self.model.pool_rankings_myopic.remove(pool)
         # Undelegate delegators' stake
         self.remove_delegations(pool)
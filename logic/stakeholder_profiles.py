@@ -1,38 +1,44 @@
 from logic.stakeholder import Stakeholder
 import logic.helper as hlp
 
-from sortedcontainers import SortedList
-
 
 class NonMyopicStakeholder(Stakeholder):
+    __slots__ = []
+
     def __init__(self, unique_id, model, stake, cost, strategy=None):
         super().__init__(unique_id=unique_id, model=model, stake=stake, cost=cost, strategy=strategy)
         self.rankings = self.model.pool_rankings
 
     def calculate_operator_utility_from_strategy(self, strategy):
         potential_pools = strategy.owned_pools.values()
-        temp_rankings = SortedList(
-            [pool for pool in self.rankings if pool is not None and pool.owner != self.unique_id],
-            key=hlp.pool_comparison_key)
-        temp_rankings.update(potential_pools)
-
         utility = 0
         for pool in potential_pools:
-            pool_utility = self.calculate_operator_utility_from_pool(pool, temp_rankings)
+            pool_utility = self.calculate_operator_utility_from_pool(pool, potential_pools)
             utility += pool_utility
         return utility
 
-    def calculate_operator_utility_from_pool(self, pool, all_pool_rankings):
-        non_myopic_pool_stake = hlp.calculate_non_myopic_pool_stake(
-            pool=pool,
-            pool_rankings=all_pool_rankings,
-            reward_scheme=self.model.reward_scheme,
-            total_stake=self.model.total_stake
+    def calculate_operator_utility_from_pool(self, pool, potential_pools):
+        # the pools that would rank higher than this one are the agent's other potential pools and the better pools of
+        # other agents, which are read off the model's rankings instead of building new rankings that merge the two
+        pool_key = hlp.pool_comparison_key(pool)
+        better_pools = [
+            p for p in self.rankings.islice(stop=self.rankings.bisect_key_left(pool_key))
+            if p is not None and p.owner != self.unique_id
+        ]
+        better_pools.extend(p for p in potential_pools if hlp.pool_comparison_key(p) < pool_key)
+        reward_scheme = self.model.reward_scheme
+        non_myopic_pool_stake = hlp.calculate_non_myopic_pool_stake_from_rank(
+            pool_pledge=pool.pledge,
+            pool_stake=pool.stake,
+            pool_saturation_threshold=reward_scheme.get_pool_saturation_threshold(pool.pledge),
+            rank_in_top_pools=hlp.is_pool_in_top_pools_given_better_pools(
+                better_pools, reward_scheme, self.model.total_stake
+            )
         )
 
         return hlp.calculate_operator_utility_from_pool(
             pool_stake=non_myopic_pool_stake, pledge=pool.pledge, margin=pool.margin, cost=pool.cost,
-            reward_scheme=self.model.reward_scheme
+            reward_scheme=reward_scheme
         )
 
     def calculate_delegator_utility_from_pool(self, pool, stake_allocation):
@@ -44,7 +50,8 @@ class NonMyopicStakeholder(Stakeholder):
                 pool=pool,
                 pool_rankings=self.rankings,
                 reward_scheme=self.model.reward_scheme,
-                total_stake=self.model.total_stake
+                total_stake=self.model.total_stake,
+                rank_in_top_pools=self.model.is_pool_in_top_pools(pool)
             ),
             current_stake
         )
@@ -52,51 +59,73 @@ class NonMyopicStakeholder(Stakeholder):
             stake_allocation, pool_stake, pool.pledge, pool.margin, pool.cost, self.model.reward_scheme
         )
 
-    def calculate_margins_and_utility(self, num_pools):
+    def calculate_target_desirabilities(self, fixed_pools_ranked):
+        """
+        Calculate the desirability that a pool of the agent would need to surpass each of the given pools. As the agent
+        is non myopic, they also aim to surpass the potential profit of the pools (which is their expected
+        desirability in the long-term)
+        @param fixed_pools_ranked: list with the pools to compete with (see rank_fixed_pools)
+        @return: list of tuples with the boosted desirability of each pool and the boosted desirability or potential
+                profit of the pool (whichever is higher)
+        """
+        boost = 1e-6  # to ensure that the new desirability will be higher than the target one
+        target_desirabilities = []
+        for target_pool in fixed_pools_ranked:
+            target_desirability, target_pp = (target_pool.desirability, target_pool.potential_profit) \
+                if target_pool is not None else (0, 0)
+            target_desirability += boost
+            target_desirabilities.append((target_desirability, max(target_desirability, target_pp)))
+        return target_desirabilities
+
+    def calculate_margins_and_utility(self, num_pools, target_desirabilities=None):
+        # the attributes used in the loop below are looked up once
+        reward_scheme = self.model.reward_scheme
+        k = reward_scheme.k
         cost_per_pool = self.calculate_cost_per_pool(num_pools)
         pledge_per_pool = self.determine_pledge_per_pool(num_pools)
-        pool_saturation_threshold = self.model.reward_scheme.get_pool_saturation_threshold(pledge_per_pool)
+        pool_saturation_threshold = reward_scheme.get_pool_saturation_threshold(pledge_per_pool)
         potential_profit_per_pool = hlp.calculate_potential_profit(
-            reward_scheme=self.model.reward_scheme, pledge=pledge_per_pool, cost=cost_per_pool
+            reward_scheme=reward_scheme, pledge=pledge_per_pool, cost=cost_per_pool
         )
-        boost = 1e-6  # to ensure that the new desirability will be higher than the target one
         margins = []  # note that pools by the same agent may end up with different margins  because of the different pools they aim to outperform
         utility = 0
+        # a pool is assumed to either end up saturated or with just its pledge (if it doesn't make it to the top k),
+        # so the corresponding rewards don't change within the loop and are only calculated once
+        private_pool_utility = hlp.calculate_operator_utility_from_pool(
+            pool_stake=pledge_per_pool, pledge=pledge_per_pool, margin=0, cost=cost_per_pool,
+            reward_scheme=reward_scheme
+        )
+        # the same pledges keep coming up for the agent, so the (cached) helper function is used for the reward
+        saturated_pool_reward = hlp.calculate_pool_reward(
+            reward_scheme=reward_scheme, pool_stake=pool_saturation_threshold, pool_pledge=pledge_per_pool
+        )
+        saturated_pool_stake_fraction = pledge_per_pool / pool_saturation_threshold
 
-        fixed_pools_ranked = [
-            pool
-            for pool in self.rankings
-            if pool is None or pool.owner != self.unique_id
-        ]
+        if target_desirabilities is None:
+            target_desirabilities = self.calculate_target_desirabilities(self.rank_fixed_pools())
 
         for t in range(1, num_pools + 1):
-            target_pool = fixed_pools_ranked[
-                self.model.reward_scheme.k - t]  # todo remove dependency from k to accommodate broader class of reward schemes
-            target_desirability, target_pp = (target_pool.desirability, target_pool.potential_profit) \
-                if target_pool is not None else (0, 0)
-            target_desirability += boost
+            target_desirability, max_target_desirability = target_desirabilities[k - t]  # todo remove dependency from k to accommodate broader class of reward schemes
             if potential_profit_per_pool < target_desirability:
                 # can't reach target desirability even with zero margin, so we can assume that the pool won't be in the top k
                 margins.append(0)
-                utility += hlp.calculate_operator_utility_from_pool(
-                    pool_stake=pledge_per_pool, pledge=pledge_per_pool, margin=0, cost=cost_per_pool,
-                    reward_scheme=self.model.reward_scheme
-                )
+                utility += private_pool_utility
             else:
                 # the pool has potential to surpass the target desirability so we proceed by finding an appropriate margin
                 # as the agent is non myopic they try to surpass the target pool's potential profit
                 # (which is its expected desirability in the long-term) rather than its current desirability
-                max_target_desirability = max(target_desirability, target_pp)
                 margins.append(hlp.calculate_suitable_margin(potential_profit=potential_profit_per_pool,
                                                              target_desirability=max_target_desirability))
-                utility += hlp.calculate_operator_utility_from_pool(
-                    pool_stake=pool_saturation_threshold, pledge=pledge_per_pool, margin=margins[-1],
-                    cost=cost_per_pool, reward_scheme=self.model.reward_scheme
+                utility += hlp.calculate_operator_reward_from_pool(
+                    pool_margin=margins[-1], pool_cost=cost_per_pool, pool_reward=saturated_pool_reward,
+                    operator_stake_fraction=saturated_pool_stake_fraction
                 )
         return margins, utility
 
 
 class MyopicStakeholder(Stakeholder):
+    __slots__ = []
+
     def __init__(self, unique_id, model, stake, cost, strategy=None):
         super().__init__(unique_id=unique_id, model=model, stake=stake, cost=cost, strategy=strategy)
         self.rankings = self.model.pool_rankings_myopic
@@ -120,52 +149,62 @@ class MyopicStakeholder(Stakeholder):
             stake_allocation, current_stake, pool.pledge, pool.margin, pool.cost, self.model.reward_scheme
         )
 
-    def calculate_margins_and_utility(self, num_pools):
+    def calculate_target_desirabilities(self, fixed_pools_ranked):
+        """
+        Calculate the desirability that a pool of the agent would need to surpass each of the given pools (based on
+        their current profit, as the agent is myopic)
+        @param fixed_pools_ranked: list with the pools to compete with (see rank_fixed_pools)
+        @return: list with the boosted myopic desirability of each pool
+        """
+        boost = 1e-6  # to ensure that the new desirability will be higher than the target one
+        reward_scheme = self.model.reward_scheme
+        return [
+            (target_pool.get_myopic_desirability(reward_scheme) if target_pool is not None else 0) + boost
+            for target_pool in fixed_pools_ranked
+        ]
+
+    def calculate_margins_and_utility(self, num_pools, target_desirabilities=None):
+        # the attributes used in the loop below are looked up once
+        reward_scheme = self.model.reward_scheme
+        k = reward_scheme.k
         cost_per_pool = self.calculate_cost_per_pool(num_pools)
         pledge_per_pool = self.determine_pledge_per_pool(num_pools)
-        pool_saturation_threshold = self.model.reward_scheme.get_pool_saturation_threshold(pledge_per_pool)
+        pool_saturation_threshold = reward_scheme.get_pool_saturation_threshold(pledge_per_pool)
 
         agent_total_delegated_stake = max(sum([pool.stake for pool in self.strategy.owned_pools.values()]), self.stake)
         expected_stake_per_pool = agent_total_delegated_stake / num_pools
         profit_per_pool = hlp.calculate_current_profit(
-            expected_stake_per_pool, pledge_per_pool, cost_per_pool, self.model.reward_scheme
+            expected_stake_per_pool, pledge_per_pool, cost_per_pool, reward_scheme
         )
-        boost = 1e-6  # to ensure that the new desirability will be higher than the target one
         margins = []  # note that pools by the same agent may end up with different margins  because of the different pools they aim to outperform
         utility = 0
+        # the reward of the pools doesn't depend on their margin, so it can be calculated outside the loop
+        # (and the same pledges keep coming up for the agent, so the cached helper function is used)
+        saturated_pool_reward = hlp.calculate_pool_reward(
+            reward_scheme=reward_scheme, pool_stake=pool_saturation_threshold, pool_pledge=pledge_per_pool
+        )
+        saturated_pool_stake_fraction = pledge_per_pool / pool_saturation_threshold
 
-        fixed_pools_ranked = [
-            pool
-            for pool in self.rankings
-            if pool is None or pool.owner != self.unique_id
-        ]
+        if target_desirabilities is None:
+            target_desirabilities = self.calculate_target_desirabilities(self.rank_fixed_pools())
 
         for t in range(1, num_pools + 1):
-            target_pool = fixed_pools_ranked[
-                self.model.reward_scheme.k - t]  # todo remove dependency from k to accommodate broader class of reward schemes
-            if target_pool is None:
-                target_desirability = 0
-            else:
-                target_pool_current_profit = hlp.calculate_current_profit(
-                    target_pool.stake, target_pool.pledge, target_pool.cost, self.model.reward_scheme
-                )
-                target_desirability = hlp.calculate_myopic_pool_desirability(target_pool.margin,
-                                                                             target_pool_current_profit)
-            target_desirability += boost
-
+            target_desirability = target_desirabilities[k - t]  # todo remove dependency from k to accommodate broader class of reward schemes
             margins.append(
                 hlp.calculate_suitable_margin(
                     potential_profit=profit_per_pool, target_desirability=target_desirability
                 )
             )
-            utility += hlp.calculate_operator_utility_from_pool(
-                pool_stake=pool_saturation_threshold, pledge=pledge_per_pool, margin=margins[-1],
-                cost=cost_per_pool, reward_scheme=self.model.reward_scheme
+            utility += hlp.calculate_operator_reward_from_pool(
+                pool_margin=margins[-1], pool_cost=cost_per_pool, pool_reward=saturated_pool_reward,
+                operator_stake_fraction=saturated_pool_stake_fraction
             )
         return margins, utility
 
 
 class Abstainer(Stakeholder):
+    __slots__ = []
+
     def __init__(self, unique_id, model, stake, cost, strategy=None):
         super().__init__(unique_id=unique_id, model=model, stake=stake, cost=cost, strategy=strategy)
         self.strategy = None
@@ -36,6 +36,8 @@ def main():
         # parent_dir
         metrics=args.metrics,
         generate_graphs=args.generate_graphs,
+        save_pickle=args.save_pickle,
+        verbose=args.verbose,
         input_from_file=args.input_from_file
     )
 
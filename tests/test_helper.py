@@ -1,6 +1,7 @@
 import random
 
 import pytest
+import numpy as np
 import logic.helper as hlp
 import logic.reward_schemes as rss
 
@@ -27,78 +28,46 @@ def test_generate_stake_distr_flat():
     assert pytest.approx(sum(stk_distr)) == 1
 
 
-def test_calculate_pool_reward_variable_stake():
+@pytest.mark.parametrize("a0,stakes,pledges,results_are_ordered", [
+    # the reward grows with the stake until the pool gets saturated
+    (0.3, [0.01, 0.1, 0.2], [0.01, 0.01, 0.01], lambda results: results[0] < results[1] == results[2]),
+    # the reward grows with the pledge of the pool
+    (0.3, [0.1, 0.1, 0.1], [0.01, 0.05, 0.1], lambda results: results[0] < results[1] < results[2]),
+    # with a0 = 0 the pledge makes no difference, but the stake does (until saturation)
+    (0, [0.01, 0.1, 0.2], [0.01, 0.01, 0.01], lambda results: results[0] < results[1] == results[2]),
+    (0, [0.1, 0.1, 0.1], [0.01, 0.05, 0.1], lambda results: results[0] == results[1] == results[2]),
+], ids=["variable_stake", "variable_pledge", "variable_stake_a0_zero", "variable_pledge_a0_zero"])
+def test_calculate_pool_reward(a0, stakes, pledges, results_are_ordered):
     # GIVEN
-    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
-    stakes = [0.01, 0.1, 0.2]
-    pledges = [0.01, 0.01, 0.01]
+    reward_scheme = rss.CardanoRSS(k=10, a0=a0)
 
     # WHEN
-    results = [
-        hlp.calculate_pool_reward(
-            reward_scheme=reward_scheme,
-            pool_stake=stakes[i],
-            pool_pledge=pledges[i],
-        )
-        for i in range(len(stakes))
-    ]
+    results = hlp.calculate_pool_rewards(
+        reward_scheme=reward_scheme, pool_stakes=np.array(stakes), pool_pledges=np.array(pledges)
+    )
 
     # THEN
-    assert results[0] < results[1] == results[2]
-
-
-def test_calculate_pool_reward_variable_pledge():
-    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
-    stakes = [0.1, 0.1, 0.1]
-    pledges = [0.01, 0.05, 0.1]
-
-    results = [
-        hlp.calculate_pool_reward(
-            reward_scheme=reward_scheme,
-            pool_stake=stakes[i],
-            pool_pledge=pledges[i]
-        )
-        for i in range(len(stakes))
+    assert results_are_ordered(results)
+    # the vectorised version gives the same results as the scalar one
+    assert results.tolist() == [
+        hlp.calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=stake, pool_pledge=pledge)
+        for stake, pledge in zip(stakes, pledges)
     ]
 
-    assert results[0] < results[1] < results[2]
-
-
-def test_calculate_pool_reward_variable_stake_a0_zero():
-    # GIVEN
-    reward_scheme = rss.CardanoRSS(k=10, a0=0)
-    stakes = [0.01, 0.1, 0.2]
-    pledges = [0.01, 0.01, 0.01]
-
-    # WHEN
-    results = [
-        hlp.calculate_pool_reward(
-            reward_scheme=reward_scheme,
-            pool_stake=stakes[i],
-            pool_pledge=pledges[i]
-        )
-        for i in range(len(stakes))
-    ]
-
-    # THEN
-    assert results[0] < results[1] == results[2]
-
 
-def test_calculate_pool_reward_variable_pledge_a0_zero():
-    reward_scheme = rss.CardanoRSS(k=10, a0=0)
-    stakes = [0.1, 0.1, 0.1]
-    pledges = [0.01, 0.05, 0.1]
-
-    results = [
-        hlp.calculate_pool_reward(
-            reward_scheme=reward_scheme,
-            pool_stake=stakes[i],
-            pool_pledge=pledges[i]
-        )
-        for i in range(len(stakes))
-    ]
+def test_calculate_pool_reward_cache_cleared():
+    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
+    reward = hlp.calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=0.05, pool_pledge=0.01)
+    assert reward == reward_scheme.calculate_pool_reward(pool_pledge=0.01, pool_stake=0.05)
 
-    assert results[0] == results[1] == results[2]
+    # the cached results are discarded when the parameters of the reward scheme change
+    reward_scheme.a0 = 0.1
+    new_reward = hlp.calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=0.05, pool_pledge=0.01)
+    assert new_reward == reward_scheme.calculate_pool_reward(pool_pledge=0.01, pool_stake=0.05)
+    assert new_reward != reward
+    reward_scheme.k = 100
+    assert hlp.calculate_pool_reward(reward_scheme=reward_scheme, pool_stake=0.05, pool_pledge=0.01) == \
+           reward_scheme.calculate_pool_reward(pool_pledge=0.01, pool_stake=0.05)
 
 
 def test_calculate_ranks():
@@ -106,6 +75,19 @@ def test_calculate_ranks():
     ranks = {5: 4, 3: 3, 1: 5, 12: 1, 8: 2}
     assert hlp.calculate_ranks(desirabilities) == ranks
 
+    assert hlp.calculate_ranks(dict()) == dict()
+
+
+def test_calculate_ranks_matches_sorting():
+    rng = random.Random(42)
+    desirabilities = {i: rng.choice([0.1, 0.2, rng.random()]) for i in range(1, 200)}
+    potential_profits = {i: rng.choice([0.5, rng.random()]) for i in desirabilities}
+    ranks = hlp.calculate_ranks(desirabilities, potential_profits)
+
+    sorted_ids = sorted(desirabilities, key=lambda i: (-desirabilities[i], -potential_profits[i], i))
+    assert ranks == {pool_id: rank for rank, pool_id in enumerate(sorted_ids, start=1)}
+    assert all(type(rank) is int for rank in ranks.values())
+
 
 def test_calculate_ranks_with_tie_breaking():
     desirabilities = {5: 0.2, 3: 0.2, 1: 0.1, 12: 0.9, 8: 0.9}
@@ -238,18 +220,41 @@ def test_calculate_non_myopic_pool_stake():
     assert pool_stake_nm == 0.01
 
 
-# todo update test
-def test_read_stake_distr_from_file():
-    # case 1: file exists and n == rows
-    assert True
+def test_is_pool_in_top_pools():
+    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
+    pools = [
+        Pool(pool_id=i, cost=0.0001, pledge=0.001, owner=i, reward_scheme=reward_scheme, margin=0)
+        for i in range(1, 12)
+    ]
+    ranks = sorted(pools, key=hlp.pool_comparison_key)
+
+    # the first k pools suffice to cover the total stake, so only they are in the top pools
+    assert all(hlp.is_pool_in_top_pools(pool=pool, pool_rankings=ranks, reward_scheme=reward_scheme, total_stake=1)
+               for pool in ranks[:10])
+    assert not hlp.is_pool_in_top_pools(pool=ranks[10], pool_rankings=ranks, reward_scheme=reward_scheme,
+                                        total_stake=1)
+
+    # the result agrees with the non-myopic stake that is calculated when the rank is given
+    for pool in ranks:
+        rank_in_top_pools = hlp.is_pool_in_top_pools(pool=pool, pool_rankings=ranks, reward_scheme=reward_scheme,
+                                                     total_stake=1)
+        assert hlp.calculate_non_myopic_pool_stake(
+            pool=pool, pool_rankings=ranks, reward_scheme=reward_scheme, total_stake=1,
+            rank_in_top_pools=rank_in_top_pools
+        ) == hlp.calculate_non_myopic_pool_stake(
+            pool=pool, pool_rankings=ranks, reward_scheme=reward_scheme, total_stake=1
+        )
 
-    # case 2: file exists and n < rows
-    assert True
+    # the order in which the better pools are given doesn't matter
+    for rank, pool in enumerate(ranks):
+        assert hlp.is_pool_in_top_pools_given_better_pools(
+            better_pools=list(reversed(ranks[:rank])), reward_scheme=reward_scheme, total_stake=1
+        ) == hlp.is_pool_in_top_pools(pool=pool, pool_rankings=ranks, reward_scheme=reward_scheme, total_stake=1)
 
-    # case 3: file exists and n > rows
-    assert True
 
-    # case 4: file does not exist
+# todo update test and add cases for when the file exists (with n == rows, n < rows and n > rows)
+def test_read_stake_distr_from_file():
+    # file does not exist
     filename = 'fake-filename'
     with pytest.raises(FileNotFoundError) as e_info:
         hlp.read_stake_distr_from_file(filename=filename, num_agents=1000)
@@ -263,6 +268,27 @@ def test_write_read_seq_id():
     assert seq_id == 555
 
 
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_export_json_file(tmp_path, monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(hlp, 'orjson', None)
+    elif hlp.orjson is None:
+        pytest.skip('orjson is not installed')
+    data = {
+        'n': 100, 'a0': 0.3, 'cost_min': 1e-05, 'execution_id': 'test', 'metrics': [1, 2, 6],
+        'agent_profile_distr': np.array([1, 0, 0]), 'seed': np.int64(42), 'pareto_param': float('nan'),
+        'parent_dir': tmp_path
+    }
+    filepath = tmp_path / 'args.json'
+    hlp.export_json_file(data, filepath)
+
+    assert hlp.read_args_from_file(filepath) == {
+        'n': 100, 'a0': 0.3, 'cost_min': 1e-05, 'execution_id': 'test', 'metrics': [1, 2, 6],
+        'agent_profile_distr': [1, 0, 0], 'seed': 42, 'pareto_param': None, 'parent_dir': str(tmp_path)
+    }
+    assert filepath.read_text().splitlines()[1] == '  "n": 100,'
+
+
 def test_calculate_pool_reward_cip_50():
     stake = 0.01
     pledge = 0.001
@@ -273,6 +299,42 @@ def test_calculate_pool_reward_cip_50():
     assert r == 0.01
 
 
+def test_calculate_potential_profits():
+    reward_schemes = [
+        rss.CardanoRSS(k=10, a0=0.3),
+        rss.SimplifiedRSS(k=10, a0=0.3),
+        rss.FlatPledgeBenefitRSS(k=10, a0=0.3),
+        rss.CurvePledgeBenefitRSS(k=10, a0=0.3, crossover_factor=8, curve_root=3),
+        rss.CIP50RSS(k=10, a0=100)
+    ]
+    pledges = np.array([0.0001, 0.001, 0.01, 0.2])
+    costs = np.array([0.001, 0.0001, 0.002, 0.001])
+
+    for reward_scheme in reward_schemes:
+        potential_profits = hlp.calculate_potential_profits(reward_scheme, pledges, costs)
+        expected = [
+            hlp.calculate_potential_profit(reward_scheme=reward_scheme, pledge=pledge, cost=cost)
+            for pledge, cost in zip(pledges, costs)
+        ]
+        assert potential_profits == pytest.approx(expected)
+
+
+def test_calculate_potential_profit_parameter_change():
+    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
+    potential_profit = hlp.calculate_potential_profit(reward_scheme=reward_scheme, pledge=0.01, cost=0.001)
+
+    # the cached results are discarded as soon as a parameter of the reward scheme changes
+    reward_scheme.a0 = 0.1
+    assert hlp.calculate_potential_profit(reward_scheme=reward_scheme, pledge=0.01, cost=0.001) == \
+           rss.CardanoRSS(k=10, a0=0.1).calculate_potential_profit(pool_pledge=0.01, pool_cost=0.001)
+    reward_scheme.k = 20
+    assert hlp.calculate_potential_profit(reward_scheme=reward_scheme, pledge=0.01, cost=0.001) == \
+           rss.CardanoRSS(k=20, a0=0.1).calculate_potential_profit(pool_pledge=0.01, pool_cost=0.001)
+    reward_scheme.k = 10
+    reward_scheme.a0 = 0.3
+    assert hlp.calculate_potential_profit(reward_scheme=reward_scheme, pledge=0.01, cost=0.001) == potential_profit
+
+
 def test_find_target_pool():
     reward_scheme = rss.CardanoRSS(k=100, a0=0.3)
     target_stake = 0.14
@@ -1,3 +1,7 @@
+import random
+import statistics
+from math import fsum
+
 import pytest
 
 import logic.sim
@@ -10,7 +14,14 @@ from logic.model_reporters import *
 
 
 def test_get_number_of_pools():
-    assert True
+    model = logic.sim.Simulation()
+    assert get_number_of_pools(model) == 0
+
+    model.pools = {
+        i: Pool(owner=i, cost=0.001, pledge=0.001, margin=0.1, pool_id=i, reward_scheme=model.reward_scheme)
+        for i in range(1, 4)
+    }
+    assert get_number_of_pools(model) == 3
 
 
 def test_get_controlled_stake_distr_stat_dist(mocker):
@@ -223,3 +234,42 @@ def test_get_median_stk_rnk(mocker):
     median_stk_rank = get_median_stk_rnk(model)
 
     assert median_stk_rank == 1
+
+
+def test_pool_value_reporters_match_list_computations():
+    model = logic.sim.Simulation(n=50)
+    rng = random.Random(5)
+    model.pools = {}
+    for i in range(1, 30):
+        pool = Pool(owner=i % 7, cost=0.001, pledge=rng.uniform(1e-5, 1e-3), margin=rng.random(), pool_id=i,
+                    reward_scheme=model.reward_scheme)
+        pool.stake = rng.uniform(1e-3, 1e-2)
+        model.pools[i] = pool
+    pools = list(model.pools.values())
+
+    # the values (and types) must be exactly the ones given by the aggregation of plain lists of pool attributes
+    expected_values = {
+        get_avg_margin: statistics.mean([pool.margin for pool in pools]),
+        get_median_margin: statistics.median([pool.margin for pool in pools]),
+        get_avg_pledge: statistics.mean([pool.pledge for pool in pools]),
+        get_median_pledge: statistics.median([pool.pledge for pool in pools]),
+        get_total_pledge: fsum([pool.pledge for pool in pools]),
+        get_total_delegated_stake: fsum([pool.stake for pool in pools]),
+        get_pledge_rate: fsum([pool.pledge for pool in pools]) / fsum([pool.stake for pool in pools]),
+        get_homogeneity_factor:
+            fsum([pool.stake for pool in pools]) / (len(pools) * max([pool.stake for pool in pools])),
+        get_avg_sat_rate: statistics.mean([
+            pool.stake / model.reward_scheme.get_pool_saturation_threshold(pool.pledge) for pool in pools
+        ])
+    }
+    for reporter, expected_value in expected_values.items():
+        value = reporter(model)
+        assert value == expected_value
+        assert type(value) is float
+
+    expected_stake_per_agent = [0 for _ in range(model.n)]
+    for pool in pools:
+        expected_stake_per_agent[pool.owner] += pool.stake
+    stake_per_agent = get_pool_stakes_by_agent(model)
+    assert stake_per_agent == expected_stake_per_agent
+    assert [type(stake) for stake in stake_per_agent] == [type(stake) for stake in expected_stake_per_agent]
@@ -0,0 +1,44 @@
+import logic.helper as hlp
+import logic.reward_schemes as rss
+
+from logic.pool import Pool
+
+
+def test_get_myopic_desirability():
+    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
+    pool = Pool(pool_id=1, cost=0.001, pledge=0.01, owner=1, reward_scheme=reward_scheme, margin=0.1)
+
+    def expected_myopic_desirability():
+        current_profit = hlp.calculate_current_profit(pool.stake, pool.pledge, pool.cost, reward_scheme)
+        return hlp.calculate_myopic_pool_desirability(pool.margin, current_profit)
+
+    assert pool.get_myopic_desirability(reward_scheme) == expected_myopic_desirability()
+
+    # the cached value is updated when the stake or the margin of the pool change
+    pool.update_delegation(new_delegation=0.05, delegator_id=2)
+    assert pool.get_myopic_desirability(reward_scheme) == expected_myopic_desirability()
+    pool.margin = 0.2
+    assert pool.get_myopic_desirability(reward_scheme) == expected_myopic_desirability()
+
+    # the cached value is updated when the reward scheme changes (followed by a call to set_profit)
+    reward_scheme.a0 = 0.1
+    pool.set_profit(reward_scheme)
+    assert pool.get_myopic_desirability(reward_scheme) == expected_myopic_desirability()
+
+
+def test_copy():
+    reward_scheme = rss.CardanoRSS(k=10, a0=0.3)
+    pool = Pool(pool_id=1, cost=0.001, pledge=0.01, owner=1, reward_scheme=reward_scheme, margin=0.1)
+    pool.update_delegation(new_delegation=0.05, delegator_id=2)
+    stake = pool.stake
+    pool_copy = pool.copy()
+    assert all(getattr(pool_copy, attribute) == getattr(pool, attribute) for attribute in Pool.__slots__)
+
+    # the delegators of the two pools are independent of each other, even though they are only copied when needed
+    pool_copy.update_delegation(new_delegation=0.01, delegator_id=3)
+    assert pool_copy.delegators == {2: 0.05, 3: 0.01}
+    assert pool.delegators == {2: 0.05}
+    assert pool.stake == stake
+    pool.update_delegation(new_delegation=0, delegator_id=2)
+    assert pool.delegators == dict()
+    assert pool_copy.delegators == {2: 0.05, 3: 0.01}
@@ -1,7 +1,114 @@
+import json
+
+import pytest
+
+import logic.helper as hlp
 from logic.pool import Pool
 from logic.stakeholder import Stakeholder
 from logic.sim import Simulation
+from custom_batchrunner import custom_batch_run
 
 
 def test_revise_beliefs():
     assert False
+
+
+def test_run_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    seeds = [12, 13]
+    results = Simulation.run_batch(seeds, max_workers=2, n=50, k=5, max_iterations=5, generate_graphs=False,
+                                   metrics=[1, 2])
+
+    assert results.keys() == set(seeds)
+    for df in results.values():
+        assert list(df.columns) == ['Pool count', 'Total pledge']
+        assert len(df) > 0
+
+    # no runs take place (and no sequence ids are reserved) when the same seed is given more than once
+    with pytest.raises(ValueError):
+        Simulation.run_batch([12, 12], max_workers=2, n=50, k=5, max_iterations=5, generate_graphs=False)
+    assert hlp.read_seq_id() == 2
+
+
+def test_run_batch_with_graphs(tmp_path, monkeypatch):
+    # the graphs of each run are drawn in its worker process, without starting more processes
+    monkeypatch.chdir(tmp_path)
+    Simulation.run_batch([1, 2], max_workers=2, n=30, k=3, max_iterations=3, generate_graphs=True, metrics=[1, 2])
+
+    figure_dirs = list((tmp_path / 'output').glob('*/figures'))
+    assert len(figure_dirs) == 2
+    assert all(len(list(figure_dir.iterdir())) == 2 for figure_dir in figure_dirs)
+
+
+def test_custom_batch_run_with_graphs(tmp_path, monkeypatch):
+    # the runs take place in daemonic worker processes, which can't start processes of their own to draw the graphs
+    monkeypatch.chdir(tmp_path)
+    results, batch_run_directory = custom_batch_run(
+        Simulation, parameters={'n': 30, 'k': [3, 4], 'max_iterations': 3, 'generate_graphs': True},
+        batch_run_id='test', number_processes=2, max_steps=3, display_progress=False
+    )
+
+    assert len(results) == 2
+    figure_dirs = list(batch_run_directory.glob('*/figures'))
+    assert len(figure_dirs) == 2
+    assert all(any(figure_dir.iterdir()) for figure_dir in figure_dirs)
+
+
+def test_read_args_from_older_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # an args file written before the save_pickle and verbose options existed
+    args = dict(
+        n=10, k=2, a0=0.3, stake_distr_source='Pareto', agent_profile_distr=[1, 0, 0], inactive_stake_fraction=0,
+        inactive_stake_fraction_known=False, relative_utility_threshold=0, absolute_utility_threshold=0, seed=42,
+        pareto_param=2.0, max_iterations=5, cost_min=1e-5, cost_max=1e-4, extra_pool_cost_fraction=0.4,
+        agent_activation_order='random', iterations_after_convergence=10, reward_scheme=0, execution_id='',
+        seq_id=-1, parent_dir='', metrics=[1], generate_graphs=False
+    )
+    with open('args.json', 'w') as f:
+        json.dump(args, f)
+
+    model = Simulation(input_from_file=True)
+    assert model.n == 10
+    assert model.save_pickle is False
+    assert model.verbose is False
+
+
+def test_get_agent_ranks():
+    model = Simulation(n=10, k=2)
+    agents = model.get_agents_dict()
+    stake_ranks = model.get_agent_ranks('stake')
+    assert sorted(stake_ranks.values()) == list(range(1, 11))
+    assert all(agents[agent_id].stake >= agents[other_id].stake
+               for agent_id in agents for other_id in agents if stake_ranks[agent_id] < stake_ranks[other_id])
+
+    # the agent with the lowest cost gets the first rank if the ranking is not descending
+    cost_ranks = model.get_agent_ranks('cost', descending=False)
+    assert min(agents, key=lambda agent_id: (agents[agent_id].cost, agent_id)) == \
+           min(cost_ranks, key=cost_ranks.get)
+
+    # the ranks are only calculated once
+    assert model.get_agent_ranks('stake') is stake_ranks
+
+
+def test_seeded_trajectory(tmp_path, monkeypatch):
+    # pins the trajectory of a seeded run, so that changes that affect the reproducibility of results don't go unnoticed
+    monkeypatch.chdir(tmp_path)
+    model = Simulation(n=150, k=15, seed=1, max_iterations=100, generate_graphs=False, metrics=[1, 23])
+    model.run_model()
+    df = model.datacollector.get_model_vars_dataframe()
+
+    assert model.schedule.steps == 21
+    assert df['Pool count'].tolist() == [0, 58, 20, 17, 16, 16, 16, 16, 16, 16, 16] + [15] * 10
+    assert df['Gini-id stake'].tolist()[1:11] == pytest.approx(
+        [0.595584, 0.358155, 0.302383, 0.212501, 0.183628, 0.181814, 0.180790, 0.165452, 0.183367, 0.183802], abs=1e-6
+    )
+
+
+def test_pool_id_seq(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model = Simulation(n=10, k=2)
+    model.initialize_pool_id_seq()
+    assert [model.get_next_pool_id() for _ in range(3)] == [1, 2, 3]
+
+    model.rewind_pool_id_seq(step=2)
+    assert model.get_next_pool_id() == 2
@@ -105,6 +105,18 @@ def test_determine_pools_to_keep():
     pools_to_keep = agent.determine_pools_to_keep(new_num_pools)
     assert pools_to_keep.keys() == {1, 3}
 
+    # the returned pools are copies that can be modified without affecting the agent's current pools
+    pool1.update_delegation(new_delegation=0.003, delegator_id=5)
+    pools_to_keep = agent.determine_pools_to_keep(new_num_pools)
+    pool1_copy = pools_to_keep[1]
+    assert pool1_copy is not pool1
+    assert (pool1_copy.stake, pool1_copy.margin, pool1_copy.desirability, pool1_copy.delegators) == \
+           (pool1.stake, pool1.margin, pool1.desirability, pool1.delegators)
+    pool1_copy.margin = 0.5
+    pool1_copy.update_delegation(new_delegation=0, delegator_id=5)
+    assert pool1.margin == 0.2
+    assert pool1.delegators == {5: 0.003}
+
 
 # todo review failing test
 def test_find_delegation_move():